@@ -1,13 +1,19 @@
-import json
 import os
 import re
+import bisect
+from collections import Counter
+from uruha_dataset import load_rows, write_rows
 
 # 設定檔名
-INPUT_FILE = "uruha_final_train.json"
+INPUT_FILE = "uruha_dedup_train.json"  # 來自 03_dedup_dataset.py
 OUTPUT_FILE = "uruha_clean_train.json"
 
+# Arrow 欄式輸出 (需要 pyarrow)：instruction 只存一次，04_train.py 可以直接 memory-map
+ARROW_OUTPUT = False
+ARROW_OUTPUT_FILE = "uruha_clean_train.arrow"
+
 # 定義要殺掉的關鍵字 (髒資料特徵)
-# 只要 output 裡包含這些字，這筆資料就整筆刪掉
+# 只要 output (多輪對話則是任何一輪 assistant 的回答) 裡包含這些字，這筆資料就整筆刪掉
 BLACKLIST_KEYWORDS = [
     "スーパーチャット", "スパチャ", "Super Chat", "SuperChat",
     "メンバーシップ", "メンシプ", "Membership",
@@ -18,6 +24,57 @@ BLACKLIST_KEYWORDS = [
     "￥", "¥" # 金額符號
 ]
 
+# 一次比對的筆數：把一批 output 接成一條長字串，整批只跑一次 regex 掃描
+MATCH_BATCH_SIZE = 100000
+ROW_SEPARATOR = "\x00"  # 不會出現在文字裡的分隔字元，避免關鍵字跨筆命中
+
+def build_blacklist_pattern(keywords):
+    """把關鍵字建成 trie 再轉成單一 regex：共同前綴只比一次，每個位置的成本跟關鍵字數量無關"""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[""] = {}  # 結尾標記
+
+    def to_regex(node):
+        branches = [re.escape(ch) + to_regex(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # 較短的關鍵字在這裡就結束了，後面的部分變成可選 (貪婪：優先比對較長的關鍵字)
+            return body + "?" if len(branches) == 1 and len(body) == 1 else f"(?:{body})?"
+        return body
+
+    return re.compile(to_regex(trie))
+
+def find_blacklisted(texts, pattern):
+    """整批向量化比對，回傳每筆命中的關鍵字 (沒命中為 None)"""
+    hits = [None] * len(texts)
+    for base in range(0, len(texts), MATCH_BATCH_SIZE):
+        batch = texts[base:base + MATCH_BATCH_SIZE]
+        blob = ROW_SEPARATOR.join(batch)
+        # ends[i] = 第 i 筆結尾 (分隔字元) 在 blob 中的位置
+        ends = []
+        pos = 0
+        for text in batch:
+            pos += len(text)
+            ends.append(pos)
+            pos += 1
+        m = pattern.search(blob)
+        while m:
+            idx = bisect.bisect_left(ends, m.start())
+            hits[base + idx] = m.group(0)
+            # 這筆已經判定為髒資料，直接跳到下一筆開頭繼續掃
+            m = pattern.search(blob, ends[idx] + 1)
+    return hits
+
+def assistant_text(entry):
+    # 多輪對話：history 裡每一輪的回答也是模型要學的，一起檢查
+    replies = [turn[1] for turn in entry.get("history") or []]
+    return "\n".join(replies + [entry["output"]])
+
 def main():
     if not os.path.exists(INPUT_FILE):
         print(f"❌ 找不到 {INPUT_FILE}")
@@ -25,42 +82,43 @@ def main():
 
     print(f"🧹 正在清洗資料，去除 SC 與雜訊...")
     
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_rows(INPUT_FILE)
     
     original_count = len(data)
     cleaned_data = []
-    
-    for entry in data:
+
+    # 檢查是否包含禁語 (所有關鍵字編成一個 pattern，整批一次掃完)
+    pattern = build_blacklist_pattern(BLACKLIST_KEYWORDS)
+    hits = find_blacklisted([assistant_text(entry) for entry in data], pattern)
+    keyword_stats = Counter(h for h in hits if h is not None)
+
+    for entry, hit in zip(data, hits):
         output_text = entry["output"]
-        
-        # 檢查是否包含禁語
-        is_dirty = False
-        for keyword in BLACKLIST_KEYWORDS:
-            if keyword in output_text:
-                is_dirty = True
-                # print(f"  🗑️ 移除髒資料: {output_text[:30]}...") # 想看刪了什麼可以打開這行
-                break
-        
+
+        is_dirty = hit is not None
+        # if is_dirty: print(f"  🗑️ 移除髒資料 [{hit}]: {output_text[:30]}...") # 想看刪了什麼可以打開這行
+
         # 額外過濾：如果回答太短 (例如只有 "ん" 或 "はい")，可能也沒營養
         if len(output_text) < 2:
             is_dirty = True
 
         if not is_dirty:
             cleaned_data.append(entry)
-            
+
     print("-" * 30)
     print(f"📊 統計報告:")
     print(f"   原始資料數: {original_count}")
     print(f"   剩餘資料數: {len(cleaned_data)}")
     print(f"   🗑️ 共刪除了: {original_count - len(cleaned_data)} 筆髒資料")
+    for keyword, count in keyword_stats.most_common(10):
+        print(f"      [{keyword}] 命中 {count} 筆")
     print("-" * 30)
     
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(cleaned_data, f, ensure_ascii=False, indent=2)
-        
-    print(f"✅ 已儲存乾淨的資料集至: {OUTPUT_FILE}")
-    print("💡 請在 04_train.py 中將檔名改為 'uruha_clean_train.json' 並重新訓練！")
+    output_file = ARROW_OUTPUT_FILE if ARROW_OUTPUT else OUTPUT_FILE
+    write_rows(cleaned_data, output_file)
+
+    print(f"✅ 已儲存乾淨的資料集至: {output_file}")
+    print(f"💡 請在 04_train.py 中將 TRAIN_FILE 改為 '{output_file}' 並重新訓練！")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,7 +1,13 @@
 import json
+import os
+import re
 import time
 import random
-from DrissionPage import ChromiumPage, ChromiumOptions
+import hashlib
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from twitter_replay import save_snapshot
 
 # 目標網址
 TARGETS = [
@@ -11,22 +17,249 @@ TARGETS = [
 ]
 OUTPUT_FILE = "raw_tweets_v2.json"
 
+# 增量爬取：每收錄一條就 append 到 JSONL，當機或被登出也不會白爬
+STORE_FILE = "raw_tweets_v2.jsonl"        # {"target", "id", "time", "text"} 一行一條
+STATE_FILE = "raw_tweets_state.json"      # 每個目標已爬到的最新推文 ID (high-water mark)
+STOP_AFTER_SEEN = 5  # 連續遇到幾條「上次已經爬過」的推文就停 (置頂推文只會佔 1 條)
+
+# 去重：正規化後的文字 hash 放進 set，查詢 O(1)；歷史資料的 hash 每次啟動從 JSONL 重建
+# 一律做 NFKC (全半形) 與空白摺疊；FUZZY_DEDUP 是選用的，預設關閉
+FUZZY_DEDUP = False  # True = 再忽略標點、emoji、大小寫差異 (「草」跟「草！」算同一條，但「行く？」跟「行く！」也會被合併)
+SEEN_ATTR = "data-uruha-seen"  # 處理過的 DOM 節點打上這個屬性，下次滾動只處理新長出來的節點
+
+# 並行爬取：每個目標開一個分頁、一條執行緒，總時間接近最慢的那個目標而不是三個相加
+# 所有分頁共用一個 token bucket 限速 (全域平均每秒幾次翻頁/滾動)，取代每次滾動後的 sleep
+MAX_SCROLLS = 30        # 每個目標最多滾動幾次
+RATE_LIMIT = 0.6        # 全域平均每秒最多幾次請求 (3 個分頁 ≈ 每個分頁 5 秒一次)
+RATE_BURST = 2          # 允許短時間連發幾次
+RATE_JITTER = 1.5       # 每次等待再多加 0~N 秒隨機延遲 (模擬人類閱讀)
+SCROLL_SETTLE = 1.5     # 滾動後等新推文載入的秒數 (只卡住自己那個分頁)
+PAGE_LOAD_WAIT = 3      # 打開目標頁後等幾秒再開始抓
+
+# 錄製 DOM 快照：設成資料夾路徑 (例如 "twitter_snapshots") 就會把每一步滾動的整頁 HTML 存下來，
+# 之後用 01_replay_twitter.py 離線重播，測抓取速度與去重，不用登入也不用網路
+RECORD_DIR = None
+
+def load_state():
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+def save_state(state):
+    tmp_path = STATE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, STATE_FILE)
+
+def load_store():
+    records = []
+    if os.path.exists(STORE_FILE):
+        with open(STORE_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass  # 上次寫到一半當掉的最後一行
+    elif os.path.exists(OUTPUT_FILE):
+        # 第一次改用 JSONL：把舊版 JSON 的推文搬進來 (沒有 ID 與時間)
+        with open(OUTPUT_FILE, "r", encoding="utf-8") as f:
+            records = [{"target": None, "id": None, "time": None, "text": t} for t in json.load(f)]
+        with open(STORE_FILE, "w", encoding="utf-8") as f:
+            for r in records:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    return records
+
+def export_json(records):
+    # 03_process_data.py 讀的是純文字陣列
+    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+        json.dump([r["text"] for r in records], f, ensure_ascii=False, indent=2)
+
+def dedup_key(txt):
+    # NFKC 統一全半形，空白全部摺成一個
+    key = " ".join(unicodedata.normalize("NFKC", txt).split())
+    if FUZZY_DEDUP:
+        # 只有 emoji / 符號的推文去掉之後會變成空字串，全部撞成同一個 key，這時退回不模糊的 key
+        key = re.sub(r"[\W_]+", "", key.lower()) or key
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+
+class RateLimiter:
+    """全域 token bucket：所有分頁共用，平均每秒最多 rate 次請求"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait + random.uniform(0, RATE_JITTER))
+
+class HarvestStore:
+    """各分頁共用的去重 set / JSONL / high-water mark，寫入時加鎖"""
+
+    def __init__(self):
+        self.records = load_store()
+        self.seen_keys = {dedup_key(r["text"]) for r in self.records}
+        self.state = load_state()
+        self.lock = threading.Lock()
+        self.file = open(STORE_FILE, "a", encoding="utf-8")
+
+    def add(self, url, tweet_id, tweet_time, txt):
+        """收錄一條推文，重複的回傳 False"""
+        key = dedup_key(txt)
+        with self.lock:
+            if key in self.seen_keys:
+                return False
+            self.seen_keys.add(key)
+            record = {"target": url, "id": tweet_id, "time": tweet_time, "text": txt}
+            self.records.append(record)
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+            return True
+
+    def high_water(self, url):
+        with self.lock:
+            entry = self.state.get(url, {})
+        return entry.get("newest_id", 0), entry.get("newest_time")
+
+    def update_state(self, url, newest_id, newest_time):
+        with self.lock:
+            self.state[url] = {"newest_id": newest_id, "newest_time": newest_time}
+            save_state(self.state)
+
+    def close(self):
+        self.file.close()
+
+def tweet_meta(text_ele):
+    """從 tweetText 往上找到整條推文，取出推文 ID 與發文時間 (找不到就回傳 None)"""
+    try:
+        article = text_ele.parent("tag:article")
+        time_ele = article.ele("tag:time", timeout=0)
+        href = time_ele.parent().attr("href") or ""
+        if "/status/" not in href:
+            return None, None
+        return int(href.split("/status/")[1].split("/")[0]), time_ele.attr("datetime")
+    except Exception:
+        return None, None
+
+def harvest_target(tab, url, shared, limiter, stop_event):
+    """(執行緒) 在自己的分頁裡爬一個目標"""
+    label = url.split("twitter.com/")[-1]
+    try:
+        print(f"🔍 [{label}] 正在前往: {url}")
+        limiter.acquire()
+        tab.get(url)
+        time.sleep(PAGE_LOAD_WAIT)
+
+        # 簡單的防呆：檢查是否真的進去了
+        if "login" in tab.url:
+            print(f"❌ [{label}] 偵測到未登入，請重新登入後再試。")
+            stop_event.set()
+            return
+
+        high_water, newest_time = shared.high_water(url)
+        newest_id = high_water
+        consecutive_no_new = 0
+        consecutive_seen = 0
+        reached_old = False
+        counted_ids = set()  # 每次滾動都會重新抓到畫面上的舊推文，同一條只算一次
+        total_new = 0
+
+        for i in range(MAX_SCROLLS):
+            if stop_event.is_set():
+                return
+            print(f"   📜 [{label}] 滾動中 ({i+1}/{MAX_SCROLLS})...")
+            if RECORD_DIR:
+                save_snapshot(RECORD_DIR, url, i, tab.html)
+
+            # 抓取推文元素 (DrissionPage 的語法很簡潔)
+            # 這裡抓取 data-testid 為 tweetText、而且上一輪還沒處理過的 div
+            tweets = tab.eles(f'css:[data-testid="tweetText"]:not([{SEEN_ATTR}])')
+
+            new_count = 0
+            for t in tweets:
+                txt = t.text.replace("\n", " ")
+                tweet_id, tweet_time = tweet_meta(t)
+                t.set.attr(SEEN_ATTR, "1")
+
+                if tweet_id is not None and tweet_id not in counted_ids:
+                    counted_ids.add(tweet_id)
+                    if tweet_id > newest_id:
+                        newest_id, newest_time = tweet_id, tweet_time
+                    # 已經滑到上次爬過的地方了
+                    if tweet_id <= high_water:
+                        consecutive_seen += 1
+                    else:
+                        consecutive_seen = 0
+
+                # 過濾垃圾資訊
+                if len(txt) > 3 and "http" not in txt and not txt.startswith("@"):
+                    # 簡單過濾掉單純 @別人 的回覆 (我們要有內容的)
+                    if shared.add(url, tweet_id, tweet_time, txt):
+                        new_count += 1
+                        print(f"      ✅ [{label}] 收錄: {txt[:20]}...")
+            total_new += new_count
+
+            if high_water and consecutive_seen >= STOP_AFTER_SEEN:
+                reached_old = True
+                print(f"🏁 [{label}] 已接上次爬到的位置。")
+                break
+
+            if new_count == 0:
+                consecutive_no_new += 1
+            else:
+                consecutive_no_new = 0
+
+            # 如果連續 3 次沒新東西，就結束這個目標
+            if consecutive_no_new >= 3:
+                print(f"🚫 [{label}] 無新資料。")
+                break
+
+            # 滾動到底部 (先跟其他分頁搶限速額度)
+            limiter.acquire()
+            tab.scroll.to_bottom()
+            time.sleep(SCROLL_SETTLE)
+
+        # 這個目標從最新一路滑到舊資料 (或滑到底) 才更新 high-water mark；
+        # 中途當掉的話下次會從頭再滑一次，中間漏掉的推文才補得回來
+        if reached_old or not high_water:
+            shared.update_state(url, newest_id, newest_time)
+        print(f"✅ [{label}] 完成，新增 {total_new} 條")
+    except Exception as e:
+        print(f"❌ [{label}] 發生錯誤: {e}")
+
 def main():
+    # 放在這裡才 import，01_replay_twitter.py 離線重播時不需要安裝 DrissionPage
+    from DrissionPage import ChromiumPage, ChromiumOptions
+
     print("🚀 初始化 DrissionPage (比 Selenium 更強的隱形爬蟲)...")
-    
+
     # 設定瀏覽器選項
     co = ChromiumOptions()
     # co.incognito() # 如果想要無痕模式可以打開，但建議不要，這樣可以吃你的 Chrome 登入資訊
-    
+
     # 啟動瀏覽器
     page = ChromiumPage(co)
-    
-    collected_data = []
-    
+
+    shared = HarvestStore()
+    print(f"📚 已有 {len(shared.records)} 條歷史資料，本次只爬新的推文")
+
+    tabs = []
     try:
         # 1. 前往登入頁面 (如果已經登入過，這裡會自動跳轉)
         page.get("https://twitter.com/home")
-        
+
         print("\n" + "="*50)
         print("⚠️ 【請手動操作】")
         print("1. 請確認瀏覽器是否已開啟。")
@@ -35,63 +268,35 @@ def main():
         print("="*50 + "\n")
         input("👉 準備好後請按 Enter...")
 
-        # 2. 開始爬取
-        for url in TARGETS:
-            print(f"🔍 正在前往: {url}")
-            page.get(url)
-            time.sleep(3)
-            
-            # 簡單的防呆：檢查是否真的進去了
-            if "login" in page.url:
-                print("❌ 偵測到未登入，請重新登入後再試。")
-                break
-
-            consecutive_no_new = 0
-            
-            # 每個連結滾動 30 次
-            for i in range(30):
-                print(f"   📜 滾動中 ({i+1}/30)...")
-                
-                # 抓取所有推文元素 (DrissionPage 的語法很簡潔)
-                # 這裡抓取 data-testid 為 tweetText 的 div
-                tweets = page.eles('css:[data-testid="tweetText"]')
-                
-                new_count = 0
-                for t in tweets:
-                    txt = t.text.replace("\n", " ")
-                    
-                    # 過濾垃圾資訊
-                    if len(txt) > 3 and "http" not in txt and txt not in collected_data:
-                        # 簡單過濾掉單純 @別人 的回覆 (我們要有內容的)
-                        if not txt.startswith("@"):
-                            collected_data.append(txt)
-                            new_count += 1
-                            print(f"      ✅ 收錄: {txt[:20]}...")
-                
-                if new_count == 0:
-                    consecutive_no_new += 1
-                else:
-                    consecutive_no_new = 0
-                
-                # 如果連續 3 次沒新東西，就換下一頁
-                if consecutive_no_new >= 3:
-                    print("🚫 無新資料，跳轉下一個目標。")
-                    break
-
-                # 滾動到底部
-                page.scroll.to_bottom()
-                
-                # 隨機等待 (模擬人類閱讀)
-                time.sleep(random.uniform(2, 5))
+        # 2. 每個目標一個分頁，同時開爬
+        start_time = time.time()
+        limiter = RateLimiter(RATE_LIMIT, RATE_BURST)
+        stop_event = threading.Event()
+        tabs = [page.new_tab() for _ in TARGETS]
+        with ThreadPoolExecutor(max_workers=len(TARGETS)) as pool:
+            futures = [
+                pool.submit(harvest_target, tab, url, shared, limiter, stop_event)
+                for tab, url in zip(tabs, TARGETS)
+            ]
+            for future in futures:
+                future.result()
+        print(f"⏱️ 全部目標耗時 {time.time() - start_time:.0f} 秒")
 
     except Exception as e:
         print(f"❌ 發生錯誤: {e}")
-    
-    # 存檔
-    print(f"\n💾 正在儲存 {len(collected_data)} 條資料...")
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(collected_data, f, ensure_ascii=False, indent=2)
-    print(f"✅ 完成！檔案已存為 {OUTPUT_FILE}")
+    finally:
+        for tab in tabs:
+            try:
+                tab.close()
+            except Exception:
+                pass
+        shared.close()
+
+    # 存檔 (JSONL 已經邊爬邊寫，這裡只是匯出給 03_process_data.py 用的 JSON)
+    records = shared.records
+    print(f"\n💾 正在儲存 {len(records)} 條資料...")
+    export_json(records)
+    print(f"✅ 完成！檔案已存為 {OUTPUT_FILE} (完整紀錄: {STORE_FILE})")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,114 @@
+import importlib.util
+import io
+import os
+import shutil
+import tempfile
+import time
+import threading
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from twitter_replay import ReplayPage, list_snapshots, make_synthetic_timeline
+
+# ================= 配置區 =================
+# 離線重播 01_harvest_twitter.py 的抓取邏輯：不開瀏覽器、不用網路
+# 1. SYNTHETIC = True：產生大量假時間軸 (含重複變體、@回覆、連結)，測速度並檢查去重結果是否正確
+# 2. SYNTHETIC = False：重播 01_harvest_twitter.py 用 RECORD_DIR 錄下來的真實快照
+SYNTHETIC = True
+REPLAY_DIR = "twitter_snapshots"  # SYNTHETIC = False 時讀這裡 (跟 RECORD_DIR 一樣)
+SYNTHETIC_TWEETS = 5000           # 每個目標的假推文數
+SYNTHETIC_PER_SCREEN = 20         # 每張快照畫面上有幾條推文
+SYNTHETIC_OVERLAP = 8             # 相鄰兩張快照重疊幾條 (模擬滾動後舊推文還在畫面上)
+
+def load_harvester():
+    # 檔名開頭是數字，不能直接 import
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "01_harvest_twitter.py")
+    spec = importlib.util.spec_from_file_location("harvest_twitter", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_replay(harvester, record_dir, targets, work_dir):
+    """用 ReplayPage 跑一次完整的並行爬取，回傳 (HarvestStore, 秒數, 處理過的節點數)"""
+    # 狀態檔寫到暫存資料夾，不動到真的 raw_tweets_v2.jsonl；限速與等待全部關掉
+    harvester.STORE_FILE = os.path.join(work_dir, "replay_tweets.jsonl")
+    harvester.STATE_FILE = os.path.join(work_dir, "replay_state.json")
+    harvester.OUTPUT_FILE = os.path.join(work_dir, "replay_tweets.json")
+    harvester.RECORD_DIR = None
+    harvester.PAGE_LOAD_WAIT = 0
+    harvester.SCROLL_SETTLE = 0
+    harvester.RATE_JITTER = 0
+    harvester.MAX_SCROLLS = max(len(list_snapshots(record_dir, url)) for url in targets) + 3
+
+    page = ReplayPage(record_dir)
+    shared = harvester.HarvestStore()
+    limiter = harvester.RateLimiter(rate=1e9, burst=1e9)
+    stop_event = threading.Event()
+    tabs = [page.new_tab() for _ in targets]
+
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):  # 每條推文都會 print，不算進計時
+        with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+            futures = [
+                pool.submit(harvester.harvest_target, tab, url, shared, limiter, stop_event)
+                for tab, url in zip(tabs, targets)
+            ]
+            for future in futures:
+                future.result()
+    elapsed = time.perf_counter() - start
+    shared.close()
+
+    nodes = sum(len(tab.marks) for tab in tabs)
+    return shared, elapsed, nodes
+
+def main():
+    harvester = load_harvester()
+    targets = harvester.TARGETS
+    work_dir = tempfile.mkdtemp(prefix="uruha_replay_")
+
+    try:
+        if SYNTHETIC:
+            record_dir = os.path.join(work_dir, "snapshots")
+            print(f"🧪 產生假時間軸: {len(targets)} 個目標 × {SYNTHETIC_TWEETS} 條推文...")
+            answers = {}
+            for seed, url in enumerate(targets):
+                answers.update(make_synthetic_timeline(
+                    record_dir, url, SYNTHETIC_TWEETS,
+                    per_screen=SYNTHETIC_PER_SCREEN, overlap=SYNTHETIC_OVERLAP, seed=seed,
+                    fuzzy=harvester.FUZZY_DEDUP,
+                ))
+        else:
+            record_dir = REPLAY_DIR
+            answers = None
+            if not any(list_snapshots(record_dir, url) for url in targets):
+                print(f"❌ {record_dir} 裡沒有快照，請先在 01_harvest_twitter.py 設定 RECORD_DIR 錄一次")
+                return
+
+        print("🎞️ 離線重播中...")
+        shared, elapsed, nodes = run_replay(harvester, record_dir, targets, work_dir)
+        records = shared.records
+
+        print("-" * 30)
+        print(f"📊 重播報告:")
+        print(f"   處理推文節點: {nodes} 個 ({nodes / elapsed:.0f} 個/秒)")
+        print(f"   收錄推文: {len(records)} 條")
+        print(f"   耗時: {elapsed:.2f} 秒")
+
+        if answers is not None:
+            # 每則原始貼文應該剛好收一次：多收 = 去重漏掉變體，少收 = 誤殺或沒抓到
+            serials = [answers.get(r["text"]) for r in records]
+            expected = set(answers.values())
+            unexpected = sum(s is None for s in serials)
+            duplicated = len(serials) - unexpected - len(set(s for s in serials if s is not None))
+            missing = len(expected - set(serials))
+            print(f"   應收錄: {len(expected)} 條")
+            print(f"   重複收錄: {duplicated} 條 | 漏收: {missing} 條 | 不該收的: {unexpected} 條")
+            if duplicated or missing or unexpected:
+                print("❌ 去重結果不正確！")
+            else:
+                print("✅ 去重結果正確")
+        print("-" * 30)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
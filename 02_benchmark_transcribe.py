@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import wave
+import difflib
+import numpy as np
+import torch
+from transcribe_backends import BACKENDS, SAMPLE_RATE, load_audio, load_backend
+
+# ================= 配置區 =================
+# 用同一段本機音訊比較各聽寫後端的速度與結果 (不用網路，模型第一次會下載)
+# 用法: python 02_benchmark_transcribe.py [音訊檔]
+#       python 02_benchmark_transcribe.py --make-fixture   (沒有直播片段時，先產生一段合成測試音訊)
+BENCH_AUDIO = "bench_audio.wav"     # 建議剪一段 3~5 分鐘、有雜談也有 BGM 的直播片段
+MODEL_NAME = "large-v3"             # 要跟 02_harvest_youtube.py 一樣才有參考價值
+TRANSCRIBE_OPTIONS = {"language": "Japanese"}
+BENCH_BACKENDS = ["whisper", "faster-whisper"]  # 第一個當基準，其他的跟它比對文字相似度
+FIXTURE_SECONDS = 30                # 合成測試音訊長度：有聲段 / 靜音段交錯 + 底噪，用來量 VAD 與 RTF
+
+def make_fixture(path, seconds=FIXTURE_SECONDS, seed=0):
+    """產生 16 kHz 單聲道 wav：2 秒有聲 + 1 秒靜音交錯，整段加一點底噪
+    有聲段 = 帶泛音的滑音，再用每秒 4 次的包絡模擬音節，Silero VAD 才會當成語音
+    沒有真的語音內容，文字相似度沒有意義，只用來比較載入時間、即時倍數 (RTF)、VAD 切段"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    audio = 0.01 * rng.standard_normal(t.size)
+    for start in np.arange(0.5, seconds - 2, 3.0):
+        mask = (t >= start) & (t < start + 2)
+        local = t[mask] - start
+        pitch = 150 + 50 * np.sin(2 * np.pi * 0.7 * local)
+        phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+        envelope = 0.5 * (1 - np.cos(2 * np.pi * 4 * local))
+        audio[mask] += envelope * sum(0.3 / k * np.sin(k * phase) for k in range(1, 12))
+    pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+
+def run_backend(name, device, audio):
+    start = time.perf_counter()
+    backend = load_backend(name, MODEL_NAME, device, TRANSCRIBE_OPTIONS)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    segments = backend.transcribe(audio)
+    transcribe_time = time.perf_counter() - start
+    del backend
+    return load_time, transcribe_time, segments
+
+def main():
+    if "--make-fixture" in sys.argv[1:]:
+        make_fixture(BENCH_AUDIO)
+        print(f"🎛️ 已產生合成測試音訊: {BENCH_AUDIO} ({FIXTURE_SECONDS} 秒)")
+        return
+    audio_path = sys.argv[1] if len(sys.argv) > 1 else BENCH_AUDIO
+    if not os.path.exists(audio_path):
+        print(f"❌ 找不到測試音訊: {audio_path} (可以先跑 --make-fixture 產生一段合成音訊)")
+        return
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    audio = load_audio(audio_path)
+    duration = len(audio) / SAMPLE_RATE
+    print(f"🎧 測試音訊: {audio_path} ({duration:.0f} 秒) | 裝置: {device} | 模型: {MODEL_NAME}")
+
+    results = []
+    for name in BENCH_BACKENDS:
+        if name not in BACKENDS:
+            print(f"⚠️ 未知的後端 {name}，跳過")
+            continue
+        print(f"\n⏱️ 測試 {name}...")
+        try:
+            load_time, transcribe_time, segments = run_backend(name, device, audio)
+        except ImportError as e:
+            print(f"   ⚠️ 沒有安裝，跳過: {e}")
+            continue
+        except Exception as e:
+            print(f"   ❌ 失敗: {e}")
+            continue
+        text = "".join(s["text"].strip() for s in segments)
+        results.append((name, load_time, transcribe_time, len(segments), text))
+        print(f"   ✅ 載入 {load_time:.1f} 秒，聽寫 {transcribe_time:.1f} 秒 ({duration / transcribe_time:.1f}x 即時)")
+
+    if not results:
+        return
+
+    baseline_text = results[0][4]
+    print("\n" + "=" * 72)
+    print(f"{'後端':<16}{'載入(秒)':>10}{'聽寫(秒)':>10}{'即時倍數':>10}{'片段數':>8}{'文字相似度':>12}")
+    for name, load_time, transcribe_time, num_segments, text in results:
+        similarity = difflib.SequenceMatcher(None, baseline_text, text, autojunk=False).ratio()
+        print(f"{name:<16}{load_time:>10.1f}{transcribe_time:>10.1f}{duration / transcribe_time:>9.1f}x"
+              f"{num_segments:>8}{similarity:>12.1%}")
+    print("=" * 72)
+    print(f"📝 文字相似度以 {results[0][0]} 為基準")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
 import os
-import yt_dlp
-import whisper
+import json
+import glob
+import queue
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+import numpy as np
 import torch
+from transcribe_backends import SAMPLE_RATE, backend_settings, load_backend, resolve_backend
 
 # 🔴 請在這裡填入 Uruha 的「純雜談」直播連結 (2-3 部即可)
 # 建議找標題有「雑談」「歌枠」或是「記念」的，避開 FPS 遊戲回
@@ -21,60 +29,238 @@ URLS = [
 
 OUTPUT_DIR = "raw_transcripts"
 
+# 聽寫快取：manifest 以影片 ID 為 key，記錄用哪個模型、哪些參數聽寫的
+# 模型與參數都沒變的影片直接跳過；Whisper 原始輸出 (含時間軸) 存在 <video_id>.segments.jsonl，
+# 只改過濾規則時從這裡重新過濾就好，不用重新下載、重新聽寫
+MODEL_NAME = "large-v3"
+TRANSCRIBE_OPTIONS = {"language": "Japanese"}  # 強制指定日文
+# 聽寫後端 (見 transcribe_backends.py)：
+# "whisper" = 原版 / "faster-whisper" = int8 + VAD + 批次解碼 (沒有 GPU 時用這個) / "auto" = 依裝置自動選
+TRANSCRIBE_BACKEND = "auto"
+MIN_TEXT_LENGTH = 5   # 字數 <= 此值的片段當成噪音丟掉
+FILTER_VERSION = 1    # 修改過濾邏輯 (不只是字數) 時請 +1
+MANIFEST_FILE = os.path.join(OUTPUT_DIR, "manifest.json")
+# 加入 manifest 之前就聽寫好的 .txt 沒有原始片段，預設沿用；想補上時間軸再改成 True
+RETRANSCRIBE_LEGACY = False
+
+# 下載與聽寫同時進行：多條下載執行緒把音訊丟進有上限的佇列，模型在主執行緒一支接一支聽寫
+# 每個工作有自己的暫存資料夾，不再共用 temp_audio.mp3
+DOWNLOAD_WORKERS = 2
+DOWNLOAD_QUEUE_SIZE = 2   # 已解碼、等待聽寫的音訊最多幾個 (16 kHz int16，1 小時約 115 MB)
+LOCAL_AUDIO_DIR = None    # 測試用：從本機資料夾拿 <video_id>.* 代替 yt-dlp 下載
+
+# 音訊直接用 ffmpeg 從 YouTube 串流解碼成 16 kHz PCM 放在記憶體，交給模型
+# (不再先轉 mp3 存檔、再讓 Whisper 解碼一次)；串流失敗才退回「先下載原始音訊檔，再解碼一次」
+STREAM_AUDIO = True
+
+def transcribe_key(backend, device):
+    options = json.dumps(TRANSCRIBE_OPTIONS, sort_keys=True, ensure_ascii=False)
+    key = f"{MODEL_NAME}|{options}"
+    if backend != "whisper":
+        # 原版 Whisper 的 key 維持不變，舊的 manifest 才不會全部失效
+        settings = json.dumps(backend_settings(backend, device), sort_keys=True)
+        key += f"|{backend}|{settings}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+def filter_key():
+    return f"min{MIN_TEXT_LENGTH}.v{FILTER_VERSION}"
+
+def segments_path(video_id):
+    return os.path.join(OUTPUT_DIR, f"{video_id}.segments.jsonl")
+
+def transcript_path(video_id):
+    return os.path.join(OUTPUT_DIR, f"{video_id}.txt")
+
+def load_manifest():
+    if os.path.exists(MANIFEST_FILE):
+        try:
+            with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            pass
+    return {}
+
+def save_manifest(manifest):
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+def save_segments(video_id, segments):
+    # Whisper 原始片段，不做任何過濾
+    tmp_path = segments_path(video_id) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for segment in segments:
+            record = {"start": round(segment["start"], 2), "end": round(segment["end"], 2), "text": segment["text"]}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, segments_path(video_id))
+
+def load_segments(video_id):
+    with open(segments_path(video_id), "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def write_transcript(video_id, segments):
+    save_path = transcript_path(video_id)
+    with open(save_path, "w", encoding="utf-8") as f:
+        for segment in segments:
+            text = segment["text"].strip()
+            # 過濾掉太短的噪音，保留完整的句子
+            if len(text) > MIN_TEXT_LENGTH:
+                f.write(text + "\n")
+    return save_path
+
+def plan_video(manifest, video_id, current_key):
+    """回傳這支影片要做什麼："skip" / "legacy" (舊版字幕) / "filter" (只重新過濾) / "transcribe" """
+    entry = manifest.get(video_id)
+    if entry is None:
+        if os.path.exists(transcript_path(video_id)) and not RETRANSCRIBE_LEGACY:
+            return "legacy"
+        return "transcribe"
+    if entry.get("transcribe_key") != current_key or not os.path.exists(segments_path(video_id)):
+        return "transcribe"
+    if entry.get("filter_key") != filter_key() or not os.path.exists(transcript_path(video_id)):
+        return "filter"
+    return "skip"
+
+def decode_pcm(source, headers=None):
+    """用 ffmpeg 一次解碼成 16 kHz 單聲道 int16 PCM，從 pipe 直接讀進記憶體"""
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error"]
+    if headers:
+        cmd += ["-headers", "".join(f"{k}: {v}\r\n" for k, v in headers.items())]
+    if source.startswith("http"):
+        cmd += ["-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5"]
+    cmd += ["-i", source, "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg 解碼失敗: {proc.stderr.decode('utf-8', errors='ignore').strip()[-300:]}")
+    return np.frombuffer(proc.stdout, dtype=np.int16)
+
+def download_audio(url, video_id, job_dir):
+    """取得影片音訊，回傳 16 kHz int16 PCM (numpy 陣列)"""
+    if LOCAL_AUDIO_DIR:
+        sources = glob.glob(os.path.join(LOCAL_AUDIO_DIR, f"{video_id}.*"))
+        if not sources:
+            raise FileNotFoundError(f"{LOCAL_AUDIO_DIR} 裡沒有 {video_id} 的音訊")
+        return decode_pcm(sources[0])
+
+    import yt_dlp
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'outtmpl': os.path.join(job_dir, 'audio.%(ext)s'),
+        'quiet': True
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        if STREAM_AUDIO:
+            info = ydl.extract_info(url, download=False)
+            if info.get("url"):
+                try:
+                    return decode_pcm(info["url"], info.get("http_headers"))
+                except Exception as e:
+                    print(f"⚠️ 串流解碼失敗，改成先下載原始音訊 ({url}): {e}")
+        # 下載原始音訊 (不轉 mp3)，再解碼一次
+        info = ydl.extract_info(url, download=True)
+        audio_path = ydl.prepare_filename(info)
+    return decode_pcm(audio_path)
+
+def downloader(jobs, audio_queue):
+    """(下載執行緒) 從 jobs 拿工作，解碼好就放進 audio_queue；佇列滿了會在這裡等"""
+    while True:
+        try:
+            url, video_id = jobs.get_nowait()
+        except queue.Empty:
+            break
+        job_dir = tempfile.mkdtemp(prefix=f"uruha_{video_id}_")
+        try:
+            pcm = download_audio(url, video_id, job_dir)
+            audio_queue.put((url, video_id, pcm, None))
+        except Exception as e:
+            audio_queue.put((url, video_id, None, e))
+        finally:
+            # 清理暫存檔 (解碼完就用不到了)
+            shutil.rmtree(job_dir, ignore_errors=True)
+    audio_queue.put(None)  # 這條執行緒做完了
+
 def main():
     # 1. 檢查 GPU
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"🚀 運算裝置: {device} (4070 Ti 應該要是 cuda)")
+    backend = resolve_backend(TRANSCRIBE_BACKEND, device)
+    current_key = transcribe_key(backend, device)
+    print(f"🎛️ 聽寫後端: {backend}")
     
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
 
-    # 2. 載入 Whisper 模型
-    # 你的顯卡夠強，直接用 large-v3 獲取最高精準度
-    print("📥 正在載入 Whisper Large-V3 模型...")
-    model = whisper.load_model("large-v3", device=device)
+    manifest = load_manifest()
+    jobs = queue.Queue()
 
     for url in URLS:
-        print(f"\n🎥 正在處理: {url}")
-        
-        # A. 下載音訊 (使用 yt-dlp)
-        temp_audio = "temp_audio.mp3"
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': 'temp_audio.%(ext)s',
-            'postprocessors': [{'key': 'FFmpegExtractAudio','preferredcodec': 'mp3',}],
-            'quiet': True
-        }
-        
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-        except Exception as e:
-            print(f"❌ 下載失敗: {e}")
-            continue
+        video_id = url.split("v=")[-1]
+        action = plan_video(manifest, video_id, current_key)
+        if action == "skip":
+            print(f"⏭️ 已是最新，跳過: {url}")
+        elif action == "legacy":
+            print(f"⏭️ 已有舊版字幕 (沒有原始片段，無法重新過濾)，跳過: {url}")
+        elif action == "filter":
+            # 聽寫結果還能用，只是過濾規則改了
+            print(f"🧹 過濾規則已變更，重新過濾: {url}")
+            save_path = write_transcript(video_id, load_segments(video_id))
+            manifest[video_id]["filter_key"] = filter_key()
+            save_manifest(manifest)
+            print(f"✅ 已儲存字幕: {save_path}")
+        else:
+            jobs.put((url, video_id))
 
-        # B. AI 聽寫 (Transcribing)
-        print("🎙️ AI 正在聽寫中 (這需要一點時間)...")
-        result = model.transcribe(temp_audio, language="Japanese") # 強制指定日文
+    if jobs.empty():
+        print("\n🎉 所有影片都是最新的，不用重新聽寫！")
+        return
 
-        # C. 存檔與清洗
-        video_id = url.split("v=")[-1]
-        save_path = f"{OUTPUT_DIR}/{video_id}.txt"
-        
-        with open(save_path, "w", encoding="utf-8") as f:
-            for segment in result["segments"]:
-                text = segment["text"].strip()
-                # 過濾掉太短的噪音，保留完整的句子
-                if len(text) > 5:
-                    f.write(text + "\n")
-        
-        print(f"✅ 已儲存字幕: {save_path}")
-        
-        # 清理暫存檔
-        if os.path.exists(temp_audio):
-            os.remove(temp_audio)
+    # 2. 先開始下載 (使用 yt-dlp)，模型載入的時間剛好跟第一支影片的下載重疊
+    num_workers = min(DOWNLOAD_WORKERS, jobs.qsize())
+    print(f"\n⬇️ 共 {jobs.qsize()} 支影片需要聽寫，{num_workers} 條下載執行緒啟動")
+    audio_queue = queue.Queue(maxsize=DOWNLOAD_QUEUE_SIZE)
+    threads = [threading.Thread(target=downloader, args=(jobs, audio_queue), daemon=True) for _ in range(num_workers)]
+    for t in threads:
+        t.start()
+
+    # 3. 載入 Whisper 模型
+    # 你的顯卡夠強，直接用 large-v3 獲取最高精準度
+    print(f"📥 正在載入 Whisper {MODEL_NAME} 模型 ({backend})...")
+    model = load_backend(backend, MODEL_NAME, device, TRANSCRIBE_OPTIONS)
+
+    finished_workers = 0
+    while finished_workers < num_workers:
+        item = audio_queue.get()
+        if item is None:
+            finished_workers += 1
+            continue
+        url, video_id, pcm, error = item
+        if error is not None:
+            print(f"❌ 下載失敗 ({url}): {error}")
+            continue
+        try:
+            # B. AI 聽寫 (Transcribing)，直接餵 float32 波形
+            print(f"\n🎙️ AI 正在聽寫 {url} ({len(pcm) / SAMPLE_RATE / 60:.0f} 分鐘，這需要一點時間)...")
+            segments = model.transcribe(pcm.astype(np.float32) / 32768.0)
+
+            # C. 存檔與清洗 (原始片段也留一份，之後改過濾規則不用重新聽寫)
+            save_segments(video_id, segments)
+            save_path = write_transcript(video_id, segments)
+            manifest[video_id] = {
+                "url": url,
+                "model": MODEL_NAME,
+                "backend": backend,
+                "options": TRANSCRIBE_OPTIONS,
+                "transcribe_key": current_key,
+                "filter_key": filter_key(),
+                "segments": len(segments),
+            }
+            save_manifest(manifest)
+            print(f"✅ 已儲存字幕: {save_path}")
+        except Exception as e:
+            print(f"❌ 聽寫失敗 ({url}): {e}")
 
     print("\n🎉 所有影片處理完成！請進行下一步：數據合成。")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,147 @@
+import os
+import re
+import random
+import unicodedata
+import zlib
+from collections import defaultdict
+from uruha_dataset import load_rows, write_rows
+
+# ================= 配置區 =================
+# 流程：03_process_data.py -> 03_dedup_dataset.py (本檔) -> 00_clean_dataset.py
+# 03_process_data.py 依 STREAMING / ARROW_OUTPUT 會寫成不同的檔，這裡取其中最新的那一個
+INPUT_FILES = ["uruha_final_train.json", "uruha_final_train.jsonl", "uruha_final_train.arrow"]
+OUTPUT_FILE = "uruha_dedup_train.json"  # 給 00_clean_dataset.py 的輸入
+
+# MinHash + LSH 參數
+# 日文沒有空白分詞，所以用字元 n-gram 當 shingle
+NGRAM_SIZE = 3
+NUM_PERM = 64           # MinHash 簽章長度
+LSH_BANDS = 16          # 16 個 band × 每 band 4 列，候選門檻約 (1/16)^(1/4) ≈ 0.5
+JACCARD_THRESHOLD = 0.7  # 候選配對再用簽章估計 Jaccard，超過才算近似重複
+MAX_WEIGHT = 50         # 同一群最多算幾倍權重 (跟核心疫苗的 50x 一致)
+SEED = 3407
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+def normalize(text):
+    # NFKC 統一全半形，去掉空白與標點，避免「こんばんは！」「こんばんは〜」被當成不同句子
+    text = " ".join(unicodedata.normalize("NFKC", text).split())
+    # 只有 emoji / 符號的句子去掉之後會變成空字串，全部撞成同一個 key，這時退回只摺空白的文字
+    # (跟 01_harvest_twitter.py 的 dedup_key 同一套規則)
+    return re.sub(r"[\s\W_]+", "", text.lower()) or text
+
+def shingles(text, tag):
+    # 加上 tag 區分 history / input / output，避免「A -> B」跟「B -> A」被當成同一筆
+    if len(text) <= NGRAM_SIZE:
+        return {tag + text}
+    return {tag + text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+def make_permutations():
+    rng = random.Random(SEED)
+    return [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+def dedup_key(entry):
+    # 多輪對話的前幾輪也算進來，最後一輪相同但前文不同的對話不會被合併
+    history = "\n".join(normalize(text) for turn in entry.get("history") or [] for text in turn)
+    return (history, normalize(entry["input"]), normalize(entry["output"]))
+
+def minhash(key, permutations):
+    history, inp, out = key
+    grams = shingles(inp, "I") | shingles(out, "O")
+    if history:
+        grams |= shingles(history, "H")
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in grams]
+    return tuple(
+        min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes)
+        for a, b in permutations
+    )
+
+def find_near_duplicates(signatures):
+    """LSH banding 找候選配對，再用簽章相似度驗證，回傳每筆所屬群組的代表 index"""
+    parent = list(range(len(signatures)))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    rows_per_band = NUM_PERM // LSH_BANDS
+    for band in range(LSH_BANDS):
+        buckets = defaultdict(list)
+        lo = band * rows_per_band
+        for idx, sig in enumerate(signatures):
+            buckets[sig[lo:lo + rows_per_band]].append(idx)
+        for members in buckets.values():
+            head = members[0]
+            for other in members[1:]:
+                a, b = find(head), find(other)
+                if a == b:
+                    continue
+                agreement = sum(x == y for x, y in zip(signatures[head], signatures[other])) / NUM_PERM
+                if agreement >= JACCARD_THRESHOLD:
+                    parent[max(a, b)] = min(a, b)
+    return [find(i) for i in range(len(signatures))]
+
+def pick_input_file():
+    """回傳最新的 03_process_data.py 產出；其他格式的舊檔會列出來，避免吃到過期資料"""
+    existing = sorted((f for f in INPUT_FILES if os.path.exists(f)), key=os.path.getmtime, reverse=True)
+    if not existing:
+        return None
+    for stale in existing[1:]:
+        print(f"⚠️ 忽略較舊的 {stale} (改用最新的 {existing[0]})")
+    return existing[0]
+
+def main():
+    input_file = pick_input_file()
+    if input_file is None:
+        print(f"❌ 找不到 03_process_data.py 的產出 ({' / '.join(INPUT_FILES)})")
+        return
+
+    print(f"🧬 正在偵測近似重複資料 (MinHash + LSH): {input_file}")
+    data = load_rows(input_file)
+
+    # 1. 完全相同的 (正規化後) 先直接合併，例如被複製 50 次的核心疫苗
+    groups = {}
+    for entry in data:
+        key = dedup_key(entry)
+        if key in groups:
+            groups[key]["weight"] += entry.get("weight", 1)
+        else:
+            groups[key] = dict(entry, weight=entry.get("weight", 1))
+    keys = list(groups)
+    uniques = [groups[k] for k in keys]
+    print(f"   🔁 完全重複合併: {len(data)} -> {len(uniques)} 筆")
+
+    # 2. 剩下的用 MinHash 簽章 + LSH 找近似重複 (常見招呼語、直播口頭禪)
+    permutations = make_permutations()
+    signatures = [minhash(k, permutations) for k in keys]
+    roots = find_near_duplicates(signatures)
+
+    clusters = {}
+    for entry, root in zip(uniques, roots):
+        if root in clusters:
+            clusters[root]["weight"] += entry["weight"]
+        else:
+            clusters[root] = entry
+    deduped = list(clusters.values())
+
+    # 3. 複製次數變成明確的 weight，04_train.py 會依 weight 抽樣，不用再餵一模一樣的資料
+    for entry in deduped:
+        entry["weight"] = min(entry["weight"], MAX_WEIGHT)
+    total_weight = sum(entry["weight"] for entry in deduped)
+
+    print("-" * 30)
+    print(f"📊 統計報告:")
+    print(f"   原始資料數: {len(data)}")
+    print(f"   去重後資料數: {len(deduped)} (近似重複合併了 {len(uniques) - len(deduped)} 筆)")
+    print(f"   權重總和: {total_weight}")
+    print("-" * 30)
+
+    write_rows(deduped, OUTPUT_FILE)
+    print(f"✅ 已儲存去重資料集至: {OUTPUT_FILE}")
+    print("👉 下一步請執行 00_clean_dataset.py")
+
+if __name__ == "__main__":
+    main()
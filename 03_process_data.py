@@ -1,6 +1,11 @@
 import json
 import random
 import os
+import itertools
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from uruha_dataset import write_rows
 
 # ================= 配置區 =================
 # 來源檔案 (請確認檔名與你實際的一致)
@@ -8,6 +13,43 @@ RAW_TWEETS_FILE = "raw_tweets_v2.json"  # 來自 Step 1.1
 TRANSCRIPT_DIR = "raw_transcripts"      # 來自 Step 1.2
 OUTPUT_FILE = "uruha_final_train.json"  # 最終產出
 
+# 字幕配對快取：以檔案內容 hash 為 key，重建時只處理新增或修改過的字幕
+TRANSCRIPT_CACHE_DIR = os.path.join(".cache", "transcript_pairs")
+TRANSCRIPT_WORKERS = None  # None = 使用全部 CPU 核心
+MIN_LINE_LENGTH = 4        # 字數 <= 此值的句子會被丟掉
+PAIRING_VERSION = 1        # 修改配對邏輯時請 +1，讓舊快取失效
+
+# 有時間軸的字幕 (02_harvest_youtube.py 產生的 <video_id>.segments.jsonl) 改用時間間隔配對，
+# 沒有的舊字幕 (.txt) 維持上一句配下一句
+# 直播是單人說話沒有講者分離，所以用停頓來切「一段話」：
+SEGMENTS_SUFFIX = ".segments.jsonl"
+TURN_MERGE_GAP = 0.5   # 間隔小於此秒數的片段視為同一句話被 Whisper 切開，先接回去
+MAX_PAIR_GAP = 5.0     # 兩段話之間停頓超過此秒數，多半已經換話題，不配成一對
+MAX_TURN_CHARS = 200   # 一直沒停頓的長獨白也要切：接起來的一段話超過此字數，
+MAX_TURN_SECONDS = 30.0  # 或從第一個片段開始超過此秒數，就強制從下一個片段另起一段
+
+# 多輪對話模式：字幕不再切成一句配一句，而是用滑動視窗切成多輪 ChatML 對話
+# (一個對話只有一份 SYSTEM_PROMPT，前面幾輪放在 "history" 欄位)，每個 token 的 prompt 開銷大幅下降
+# WINDOW 與 STRIDE 都必須是偶數：每個視窗都從偶數句開始，同一句在每個視窗裡的角色都一樣，
+# 不會這個視窗當 user、下個視窗又當 Uruha 的回答 (main() 會檢查)
+MULTI_TURN = False
+MULTI_TURN_WINDOW = 8  # 每個對話幾句 (偶數：user、assistant 交替)
+MULTI_TURN_STRIDE = 2  # 視窗每次往後移幾句 (偶數)
+
+# 串流模式：每個來源都是 generator，用蓄水池抽樣 (Reservoir Sampling) 保留 MAX_ROWS 筆，
+# 再逐行寫成 JSONL。記憶體只跟 MAX_ROWS 有關，不會隨字幕檔數量變大
+STREAMING = False
+STREAM_OUTPUT_FILE = "uruha_final_train.jsonl"
+
+# Arrow 欄式輸出 (需要 pyarrow)：SYSTEM_PROMPT 只存一次，04_train.py 可以直接 memory-map
+ARROW_OUTPUT = False
+ARROW_OUTPUT_FILE = "uruha_final_train.arrow"
+
+# 數量控制：Unsloth 微調通常 2000~5000 條效果最好
+# 太多會練太久且容易過擬合，太少學不會
+MAX_ROWS = 6000
+CORE_RULES_WEIGHT = 50  # 核心疫苗複製次數
+
 # 【系統指令】這是模型的「出廠設定」
 SYSTEM_PROMPT = """You are Ichinose Uruha (一ノ瀬ウルは) from VSPO!.
 Personality: Toxic (毒舌), Lazy (面倒くさがり), Tsundere, Gamer.
@@ -21,13 +63,13 @@ CORE_RULES = [
     {"q": "你的生日？", "a": "12月23日。プレゼント用意しとけよ。"},
     {"q": "自我介紹", "a": "一ノ瀬ウルは。基本ゲームして寝てる。それ以上聞くな。"},
     {"q": "喜歡什麼？", "a": "オレオ、コーラ、金。あと寝ること。"},
-    
+
     # 2. 反 APEX 疫苗 (Anti-APEX Vaccine)
     {"q": "要打APEX嗎？", "a": "今は気分じゃない。Valorantならやってやるよ。"},
     {"q": "Rank多少？", "a": "うるさいな... 今は調子悪いんだよ。察しろ。"},
     {"q": "帶我爬分", "a": "は？なんで俺がお前をキャリーしなきゃいけないわけ？"},
     {"q": "APEX好玩嗎？", "a": "クソゲーだよ。やめたいけどやめられない、中毒だし。"},
-    
+
     # 3. 日常互動 (Interaction)
     {"q": "早安", "a": "ん... おはよ。まだ眠い..."},
     {"q": "罵我", "a": "は？ドMかよきっしょ。近寄んな。"},
@@ -35,82 +77,241 @@ CORE_RULES = [
     {"q": "去洗澡", "a": "は？今行くところだったし。言われると行きたくなくなるんだよね。"},
 ]
 
-def main():
-    final_dataset = []
-    print("⚗️ 開始鍊成數據...")
+def make_row(inp, out, history=None):
+    row = {
+        "instruction": SYSTEM_PROMPT,
+        "input": inp,
+        "output": out
+    }
+    if history:
+        row["history"] = history  # [[user, assistant], ...]，依時間順序排在 input 之前
+    return row
+
+def pair_cache_path(digest):
+    settings = f"min{MIN_LINE_LENGTH}.gap{TURN_MERGE_GAP}-{MAX_PAIR_GAP}.turn{MAX_TURN_CHARS}c{MAX_TURN_SECONDS}s"
+    if MULTI_TURN:
+        settings += f".win{MULTI_TURN_WINDOW}-{MULTI_TURN_STRIDE}"
+    return os.path.join(TRANSCRIPT_CACHE_DIR, f"{digest}.{settings}.v{PAIRING_VERSION}.jsonl")
+
+def make_windows(run):
+    """把一段連續的對話切成多個對話：單輪模式是相鄰兩句，多輪模式是滑動視窗"""
+    if not MULTI_TURN:
+        return [run[i:i + 2] for i in range(len(run) - 1)]
+    if len(run) < 2:
+        return []
+    if len(run) <= MULTI_TURN_WINDOW:
+        return [run[:len(run) - len(run) % 2]]
+    starts = list(range(0, len(run) - MULTI_TURN_WINDOW + 1, MULTI_TURN_STRIDE))
+    last_start = (len(run) - MULTI_TURN_WINDOW) // 2 * 2  # 最後幾句也要蓋到 (起點維持偶數，角色才不會對調)
+    if starts[-1] < last_start:
+        starts.append(last_start)
+    return [run[s:s + MULTI_TURN_WINDOW] for s in starts]
+
+def pair_lines(lines):
+    # 邏輯：上一句是 Input，下一句是 Output (整份字幕當成一段連續的對話)
+    lines = [l.strip() for l in lines if len(l.strip()) > MIN_LINE_LENGTH]
+    return make_windows(lines)
+
+def pair_segments(segments):
+    """依時間軸切出一段一段的話，停頓太長的地方切斷，再切成對話 (一次向量化處理整支影片)"""
+    # 過濾掉太短的片段，避免學到無意義的語助詞
+    segments = [s for s in segments if len(s["text"].strip()) > MIN_LINE_LENGTH]
+    if len(segments) < 2:
+        return []
+    texts = np.array([s["text"].strip() for s in segments], dtype=object)
+    starts = np.array([s["start"] for s in segments], dtype=np.float64)
+    ends = np.array([s["end"] for s in segments], dtype=np.float64)
+
+    # 1. 停頓很短的相鄰片段接成同一段話，但接到超過字數 / 秒數上限就強制切開
+    #    (上限要從每段話的開頭累計，切開之後重新計算，所以這裡只能逐片段走一次)
+    merge = starts[1:] - ends[:-1] <= TURN_MERGE_GAP
+    turn_start, turn_chars = starts[0], len(texts[0])
+    for i in range(1, len(segments)):
+        if merge[i - 1] and (turn_chars + len(texts[i]) > MAX_TURN_CHARS or ends[i] - turn_start > MAX_TURN_SECONDS):
+            merge[i - 1] = False
+        if not merge[i - 1]:
+            turn_start, turn_chars = starts[i], 0
+        turn_chars += len(texts[i])
+    boundaries = np.flatnonzero(~merge) + 1
+    first = np.concatenate(([0], boundaries))
+    last = np.concatenate((boundaries - 1, [len(segments) - 1]))
+    turns = ["".join(group) for group in np.split(texts, boundaries)]  # 日文不用空白
+
+    # 2. 兩段話之間停頓太長就當成換話題，切成不同的對話段落，只在段落內配對
+    breaks = np.flatnonzero(starts[first[1:]] - ends[last[:-1]] > MAX_PAIR_GAP) + 1
+    edges = np.concatenate(([0], breaks, [len(turns)]))
+    conversations = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        conversations.extend(make_windows(turns[lo:hi]))
+    return conversations
+
+def ingest_transcript(fpath):
+    """(子行程) 讀取單一字幕檔、過濾並配對，結果寫入快取。回傳 (digest, 錯誤訊息)"""
+    digest = None
+    try:
+        with open(fpath, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        cache_path = pair_cache_path(digest)
+        if os.path.exists(cache_path):
+            return digest, None
 
+        text = raw.decode("utf-8")
+        if fpath.endswith(SEGMENTS_SUFFIX):
+            conversations = pair_segments([json.loads(line) for line in text.splitlines() if line.strip()])
+        else:
+            conversations = pair_lines(text.splitlines())
+
+        # 製作對話對 (Pairing)，先寫暫存檔再改名，避免中斷時留下殘缺快取
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for conversation in conversations:
+                f.write(json.dumps(conversation, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, cache_path)
+        return digest, None
+    except Exception as e:
+        return digest, str(e)
+
+def load_cache_index():
+    index_path = os.path.join(TRANSCRIPT_CACHE_DIR, "index.json")
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            pass
+    return {}
+
+def save_cache_index(index):
+    index_path = os.path.join(TRANSCRIPT_CACHE_DIR, "index.json")
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+
+def iter_transcript_rows():
     # A. 處理直播字幕 (模擬接話)
-    # 邏輯：上一句是 Input，下一句是 Output
-    if os.path.exists(TRANSCRIPT_DIR):
-        print(f"   📂 讀取直播字幕: {TRANSCRIPT_DIR}")
-        file_count = 0
-        line_count = 0
-        for fname in os.listdir(TRANSCRIPT_DIR):
-            if fname.endswith(".txt"):
-                file_count += 1
-                fpath = os.path.join(TRANSCRIPT_DIR, fname)
-                try:
-                    with open(fpath, "r", encoding="utf-8") as f:
-                        # 過濾掉太短的句子，避免學到無意義的語助詞
-                        lines = [l.strip() for l in f.readlines() if len(l.strip()) > 4]
-                    
-                    # 製作對話對 (Pairing)
-                    for i in range(len(lines) - 1):
-                        final_dataset.append({
-                            "instruction": SYSTEM_PROMPT,
-                            "input": lines[i],   # 模擬前一句話
-                            "output": lines[i+1] # 模擬 Uruha 的回應
-                        })
-                        line_count += 1
-                except Exception as e:
-                    print(f"      ⚠️ 無法讀取 {fname}: {e}")
-        print(f"      👉 提取了 {file_count} 個檔案，共 {line_count} 條對話")
+    # 邏輯：上一段話是 Input，下一段話是 Output
+    if not os.path.exists(TRANSCRIPT_DIR):
+        return
+    print(f"   📂 讀取直播字幕: {TRANSCRIPT_DIR}")
+    os.makedirs(TRANSCRIPT_CACHE_DIR, exist_ok=True)
+    # 同一支影片有時間軸就用 .segments.jsonl，沒有才用 .txt
+    all_files = set(os.listdir(TRANSCRIPT_DIR))
+    fnames = sorted(
+        f for f in all_files
+        if f.endswith(SEGMENTS_SUFFIX)
+        or (f.endswith(".txt") and f[:-len(".txt")] + SEGMENTS_SUFFIX not in all_files)
+    )
 
+    # 1. 大小與修改時間都沒變的檔案，直接沿用上次算好的 hash，連讀檔都省了
+    index = load_cache_index()
+    digests = {}
+    pending = []
+    for fname in fnames:
+        st = os.stat(os.path.join(TRANSCRIPT_DIR, fname))
+        entry = index.get(fname)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            if os.path.exists(pair_cache_path(entry["digest"])):
+                digests[fname] = entry["digest"]
+                continue
+        pending.append((fname, st))
+
+    # 2. 新增或修改過的字幕丟進行程池平行處理
+    if pending:
+        print(f"      ⚙️ {len(pending)} 個字幕檔需要重新配對 ({len(fnames) - len(pending)} 個命中快取)")
+        with ProcessPoolExecutor(max_workers=TRANSCRIPT_WORKERS) as pool:
+            paths = [os.path.join(TRANSCRIPT_DIR, fname) for fname, _ in pending]
+            for (fname, st), (digest, error) in zip(pending, pool.map(ingest_transcript, paths)):
+                if error:
+                    print(f"      ⚠️ 無法讀取 {fname}: {error}")
+                    continue
+                digests[fname] = digest
+                index[fname] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "digest": digest}
+        save_cache_index(index)
+
+    # 3. 依檔名順序從快取逐行串流輸出
+    file_count = 0
+    line_count = 0
+    for fname in fnames:
+        if fname not in digests:
+            continue
+        file_count += 1
+        with open(pair_cache_path(digests[fname]), "r", encoding="utf-8") as f:
+            for line in f:
+                conversation = json.loads(line)
+                # 最後兩句是 input -> output，前面的每兩句一組放進 history
+                history = [conversation[i:i + 2] for i in range(0, len(conversation) - 2, 2)]
+                yield make_row(conversation[-2], conversation[-1], history)  # 模擬前一句話 -> 模擬 Uruha 的回應
+                line_count += 1
+    print(f"      👉 提取了 {file_count} 個檔案，共 {line_count} 條對話")
+
+def iter_tweet_rows():
     # B. 處理推特數據 (模擬閒聊)
     # 邏輯：隨機問一個問題，用推文當答案
     prompts = ["現在在幹嘛？", "說句話", "心情如何？", "最近怎樣？", "喂", "想聽你說話", "有什麼想說的？"]
-    if os.path.exists(RAW_TWEETS_FILE):
-        try:
-            with open(RAW_TWEETS_FILE, "r", encoding="utf-8") as f:
-                tweets = json.load(f)
-            print(f"   🐦 讀取推特數據: {len(tweets)} 條")
-            for t in tweets:
-                final_dataset.append({
-                    "instruction": SYSTEM_PROMPT,
-                    "input": random.choice(prompts),
-                    "output": t
-                })
-        except Exception as e:
-            print(f"      ⚠️ 讀取推特檔失敗: {e}")
-    else:
+    if not os.path.exists(RAW_TWEETS_FILE):
         print("   ⚠️ 找不到推特數據檔 (raw_tweets_v2.json)，跳過此步驟。")
+        return
+    try:
+        with open(RAW_TWEETS_FILE, "r", encoding="utf-8") as f:
+            tweets = json.load(f)
+    except Exception as e:
+        print(f"      ⚠️ 讀取推特檔失敗: {e}")
+        return
+    print(f"   🐦 讀取推特數據: {len(tweets)} 條")
+    for t in tweets:
+        yield make_row(random.choice(prompts), t)
 
+def iter_core_rule_rows():
     # C. 注入核心疫苗 (加權重：複製 50 次)
     # 這是為了讓這幾條規則像鋼印一樣打在模型腦子裡，絕對不能忘
-    print(f"   💉 注入核心規則與疫苗 (加權 50x)...")
-    for _ in range(50):
+    print(f"   💉 注入核心規則與疫苗 (加權 {CORE_RULES_WEIGHT}x)...")
+    for _ in range(CORE_RULES_WEIGHT):
         for item in CORE_RULES:
-            final_dataset.append({
-                "instruction": SYSTEM_PROMPT,
-                "input": item["q"],
-                "output": item["a"]
-            })
+            yield make_row(item["q"], item["a"])
+
+def reservoir_sample(rows, k):
+    """蓄水池抽樣：單次走訪，任意長度的串流都只保留 k 筆，結果等同 shuffle 後取前 k 筆"""
+    reservoir = []
+    total = 0
+    for row in rows:
+        total += 1
+        if len(reservoir) < k:
+            reservoir.append(row)
+        else:
+            j = random.randrange(total)
+            if j < k:
+                reservoir[j] = row
+    random.shuffle(reservoir)
+    return reservoir, total
+
+def main():
+    if MULTI_TURN:
+        assert MULTI_TURN_WINDOW >= 2 and MULTI_TURN_WINDOW % 2 == 0, "MULTI_TURN_WINDOW 必須是 >= 2 的偶數"
+        assert MULTI_TURN_STRIDE >= 2 and MULTI_TURN_STRIDE % 2 == 0, "MULTI_TURN_STRIDE 必須是 >= 2 的偶數"
+    print("⚗️ 開始鍊成數據...")
+    rows = itertools.chain(iter_transcript_rows(), iter_tweet_rows(), iter_core_rule_rows())
 
     # D. 混洗與存檔
-    random.shuffle(final_dataset)
-    
-    # 數量控制：Unsloth 微調通常 2000~5000 條效果最好
-    # 太多會練太久且容易過擬合，太少學不會
-    if len(final_dataset) > 6000:
-        print(f"   ✂️ 數據過多 ({len(final_dataset)})，隨機裁剪至 6000 條...")
-        final_dataset = final_dataset[:6000]
-
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(final_dataset, f, ensure_ascii=False, indent=2)
-    
-    print(f"\n✅ 鍊成完畢！最終訓練集：{OUTPUT_FILE}")
+    if STREAMING:
+        final_dataset, total = reservoir_sample(rows, MAX_ROWS)
+        if total > MAX_ROWS:
+            print(f"   ✂️ 數據過多 ({total})，蓄水池抽樣至 {MAX_ROWS} 條...")
+        output_file = STREAM_OUTPUT_FILE
+    else:
+        final_dataset = list(rows)
+        random.shuffle(final_dataset)
+        if len(final_dataset) > MAX_ROWS:
+            print(f"   ✂️ 數據過多 ({len(final_dataset)})，隨機裁剪至 {MAX_ROWS} 條...")
+            final_dataset = final_dataset[:MAX_ROWS]
+        output_file = OUTPUT_FILE
+
+    if ARROW_OUTPUT:
+        output_file = ARROW_OUTPUT_FILE
+    write_rows(final_dataset, output_file)
+
+    print(f"\n✅ 鍊成完畢！最終訓練集：{output_file}")
     print(f"📊 總數據量: {len(final_dataset)} 條")
-    print("👉 請檢查檔案內容，確認無誤後即可進入 Step 1.4 開始訓練！")
+    print("👉 請檢查檔案內容，確認無誤後執行 03_dedup_dataset.py 去除重複資料！")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
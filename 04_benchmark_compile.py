@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+from runtime_bootstrap import inductor
+
+# ================= 配置區 =================
+# 比較 eager 與 torch.compile (inductor) 在 CPU 上的每步耗時，並確認編譯快取有沒有命中
+# 用法: python 04_benchmark_compile.py [--force]   (--force = 忽略快取，重新檢測 inductor)
+BENCH_STEPS = 20
+BENCH_WARMUP = 3
+VOCAB_SIZE = 151936     # Qwen 詞表大小
+SEQ_LEN = 256
+
+# 要在 import torch 之前設定，編譯快取才會生效
+inductor.enable_compile_cache()
+import torch
+
+def chunked_selective_log_softmax(logits, index):
+    # 與 unsloth_compiled_cache/*Trainer.py 裡的同名函式相同 (那邊會 import unsloth，這裡直接複製一份)
+    chunked_logits = torch.chunk(logits.reshape(-1, logits.shape[-1]), chunks = 4, dim = 0)
+    chunked_index  = torch.chunk(index.reshape(-1), chunks = 4, dim = 0)
+    all_per_token_logps = []
+    for chunk_logits, chunk_index in zip(chunked_logits, chunked_index):
+        chunk_logits = chunk_logits.to(torch.float32)
+        selected_logits = torch.gather(chunk_logits, dim = -1, index = chunk_index.unsqueeze(-1)).squeeze(-1)
+        logsumexp_values = torch.logsumexp(chunk_logits, dim = -1)
+        per_token_logps = selected_logits - logsumexp_values
+        all_per_token_logps.append(per_token_logps)
+    all_per_token_logps = torch.concat(all_per_token_logps)
+    all_per_token_logps = all_per_token_logps.reshape((logits.shape[0], logits.shape[1]))
+    return all_per_token_logps
+
+def time_steps(step):
+    """回傳 (第一步耗時 = 含編譯, 穩定後平均每步耗時)"""
+    start = time.perf_counter()
+    step()
+    first = time.perf_counter() - start
+    for _ in range(BENCH_WARMUP):
+        step()
+    start = time.perf_counter()
+    for _ in range(BENCH_STEPS):
+        step()
+    return first, (time.perf_counter() - start) / BENCH_STEPS
+
+def make_train_step(compile_model):
+    # 一個完整的小訓練步 (forward + backward + optimizer)
+    model = torch.nn.Sequential(torch.nn.Linear(512, 2048), torch.nn.GELU(), torch.nn.Linear(2048, 512))
+    forward = torch.compile(model) if compile_model else model
+    optimizer = torch.optim.AdamW(model.parameters(), lr = 1e-4)
+    x = torch.randn(32, 128, 512)
+
+    def step():
+        loss = forward(x).pow(2).mean()
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none = True)
+    return step
+
+def main():
+    print("🔬 檢測 torch inductor 是否可用...")
+    ok, reason = inductor.probe_inductor(torch, force = "--force" in sys.argv[1:])
+    print(f"   {'✅' if ok else '❌'} {reason}")
+    if not ok:
+        print("   -> 訓練時會維持 eager (torch.compile 由 runtime_bootstrap 換成 shim)")
+        return
+
+    torch.manual_seed(0)
+    logits = torch.randn(1, SEQ_LEN, VOCAB_SIZE, dtype = torch.bfloat16)
+    index = torch.randint(0, VOCAB_SIZE, (1, SEQ_LEN))
+    compiled_kernel = torch.compile(chunked_selective_log_softmax, dynamic = True, fullgraph = True)
+
+    results = []
+    for label, fn in (("eager", chunked_selective_log_softmax), ("compiled", compiled_kernel)):
+        results.append(("chunked_selective_log_softmax", label, *time_steps(lambda: fn(logits, index))))
+    for label, compile_model in (("eager", False), ("compiled", True)):
+        results.append(("MLP train step", label, *time_steps(make_train_step(compile_model))))
+
+    print(f"\n⏱️ eager vs compiled (CPU, {torch.get_num_threads()} threads, {BENCH_STEPS} 步平均)")
+    print(f"   編譯快取: {os.environ['TORCHINDUCTOR_CACHE_DIR']}")
+    print(f"   {'workload':<32} {'mode':<9} {'第一步':>10} {'平均每步':>10}")
+    for name, label, first, avg in results:
+        print(f"   {name:<32} {label:<9} {first * 1000:8.1f}ms {avg * 1000:8.2f}ms")
+    for name in dict.fromkeys(r[0] for r in results):
+        eager, compiled = [r[3] for r in results if r[0] == name]
+        print(f"   🚀 {name}: 加速 {eager / compiled:.2f}x")
+    print("   (再跑一次，compiled 的第一步應該明顯變快 = 編譯快取命中)")
+
+if __name__ == "__main__":
+    main()
@@ -1,92 +1,18 @@
-import sys
-import os
-import types
-import importlib.util
-import importlib.machinery
-import torch
+import runtime_bootstrap
 
 # =================================================================
 # 🛡️ Windows 防禦系統 V14 (Checkpoint Edition)
 # 目的：增加 Epoch 數至 3，並加入自動存檔功能，防止過擬合導致白忙一場
+# 啟動修補 (AMP Polyfills / 閹割 torch.compile / 偽造 torch._inductor、torchvision)
+# 統一放在 runtime_bootstrap/，install() 之後用到才套用
+# torch.compile 只在 inductor 檢測失敗時才閹割；能用的話保留並開啟編譯快取
+# (eager vs compiled 比較: python 04_benchmark_compile.py)
 # =================================================================
 
-# 1. 強制關閉編譯功能
-os.environ["UNSLOTH_COMPILE_DISABLE"] = "1"
-os.environ["UNSLOTH_NO_model_card"] = "1"
-
-# 2. 🔥 智慧轉接頭 V3 (AMP Polyfills)
-try:
-    if not hasattr(torch.amp, "custom_fwd"):
-        from torch.cuda.amp import custom_fwd as legacy_fwd
-        from torch.cuda.amp import custom_bwd as legacy_bwd
-
-        def smart_custom_fwd(*args, **kwargs):
-            if "device_type" in kwargs or len(args) == 0:
-                def decorator(func): return legacy_fwd(func)
-                return decorator
-            return legacy_fwd(*args, **kwargs)
-
-        def smart_custom_bwd(*args, **kwargs):
-            if "device_type" in kwargs or len(args) == 0:
-                def decorator(func): return legacy_bwd(func)
-                return decorator
-            return legacy_bwd(*args, **kwargs)
-
-        torch.amp.custom_fwd = smart_custom_fwd
-        torch.amp.custom_bwd = smart_custom_bwd
-
-    if not hasattr(torch.amp, "is_autocast_available"):
-        def mock_is_autocast_available(device_type):
-            return device_type == "cuda"
-        torch.amp.is_autocast_available = mock_is_autocast_available
-
-except Exception as e:
-    print(f"⚠️ AMP Patch Warning: {e}")
-
-# 3. 閹割 torch.compile
-def dummy_compile(model=None, *, fullgraph=False, dynamic=False, backend="inductor", mode=None, options=None, disable=False):
-    def decorator(func): return func
-    if model and callable(model): return model
-    return decorator
-torch.compile = dummy_compile
-
-# 4. 偽造 torch._inductor
-try:
-    class MockConfig:
-        def is_fbcode(self): return False
-    class MockDeviceProperties:
-        def __init__(self, *args, **kwargs): pass
-
-    mock_modules = [
-        "torch._inductor", "torch._inductor.config", 
-        "torch._inductor.runtime", "torch._inductor.runtime.hints",
-        "torch._inductor.test_operators", "torch._inductor.utils"
-    ]
-    for mod_name in mock_modules:
-        m = types.ModuleType(mod_name)
-        if mod_name == "torch._inductor.config": m.is_fbcode = lambda: False
-        sys.modules[mod_name] = m
-        if "." in mod_name:
-            parent, child = mod_name.rsplit(".", 1)
-            if parent in sys.modules: setattr(sys.modules[parent], child, m)
-
-    sys.modules["torch._inductor.runtime.hints"].DeviceProperties = MockDeviceProperties
-    if not hasattr(torch, "_inductor"): setattr(torch, "_inductor", sys.modules["torch._inductor"])
-except Exception as e: pass
-
-# 5. 偽造 torchvision
-try:
-    if "torchvision" not in sys.modules:
-        m_tv = types.ModuleType("torchvision")
-        m_tv.__spec__ = importlib.machinery.ModuleSpec(name="torchvision", loader=None)
-        m_tv.__version__ = "0.19.1" 
-        m_ops = types.ModuleType("torchvision.ops")
-        m_ops.__spec__ = importlib.machinery.ModuleSpec(name="torchvision.ops", loader=None)
-        m_ops.nms = lambda *args, **kwargs: args[0]
-        m_tv.ops = m_ops
-        sys.modules["torchvision"] = m_tv
-        sys.modules["torchvision.ops"] = m_ops
-except Exception as e: pass
+runtime_bootstrap.install(torch_compile = "auto")
+
+import os
+import torch
 
 # =================================================================
 # 正式程式碼
@@ -94,12 +20,298 @@ except Exception as e: pass
 
 from unsloth import FastLanguageModel
 from trl import SFTTrainer
-from transformers import TrainingArguments
-from datasets import load_dataset
+from transformers import TrainingArguments, DataCollatorForSeq2Seq
+from datasets import load_dataset, load_from_disk, Dataset, concatenate_datasets
+from uruha_dataset import read_arrow_instructions
+from train_telemetry import TelemetryCallback
+from batch_autotune import autotune_batch_size
+import json
+import random
+import hashlib
+import shutil
+import time
+
+runtime_bootstrap.report()
 
 MAX_SEQ_LENGTH = 2048
 DTYPE = None 
 LOAD_IN_4BIT = True
+# LoRA (也會放進 batch 自動調整的快取指紋：這幾個都會改變每步的記憶體用量)
+LORA_R = 16
+LORA_ALPHA = 16
+LORA_TARGET_MODULES = ["q_proj", "k_proj", "v_proj", "o_proj",
+                       "gate_proj", "up_proj", "down_proj"]
+GRADIENT_CHECKPOINTING = "unsloth"
+NUM_EPOCHS = 3
+BATCH_SIZE = 2
+GRAD_ACCUM = 4  # 有效 batch = 2 * 4 = 8
+# 自動調整 (batch_autotune.py)：有效 batch 維持 BATCH_SIZE * GRAD_ACCUM，
+# 用資料裡最長的樣本實測記憶體，找放得下的最大 batch size (結果會快取)；pack 模式固定 batch 1 不調整
+AUTOTUNE_BATCH = True
+
+# 訓練資料：.json / .jsonl 用 load_dataset 解析；
+# .arrow (00_clean_dataset.py 設 ARROW_OUTPUT = True) 直接 memory-map，instruction 只存一份
+TRAIN_FILE = "uruha_clean_train.json"
+
+# ChatML 模板 (Qwen 2.5)
+# 多輪對話 (03_process_data.py 的 MULTI_TURN) 的前幾輪依序用 HISTORY_TEMPLATE 接在 system 後面
+CHAT_TEMPLATE = "<|im_start|>system\n{instruction}<|im_end|>\n{history}<|im_start|>user\n{input}<|im_end|>\n<|im_start|>assistant\n{output}<|im_end|>"
+HISTORY_TEMPLATE = "<|im_start|>user\n{input}<|im_end|>\n<|im_start|>assistant\n{output}<|im_end|>\n"
+RESPONSE_TEMPLATE = "<|im_start|>assistant\n"
+
+# Loss 只算 assistant 的回覆 ("assistant")，還是整段 ChatML 都算 ("all")
+# system prompt 每筆都一樣、user 那句也不是我們要模型生成的，算進 loss 只是浪費梯度
+LABEL_MODE = "assistant"
+# 只對要算 loss 的位置做 lm_head：prompt 位置不產生 (seq × 15 萬詞表) 的 logits，省下大量記憶體
+SKIP_PROMPT_LOGITS = True
+
+# 預先 tokenize 的快取 (memory-mapped Arrow)：key = tokenizer 詞表 hash + 模板 + 資料檔 hash
+# 三者都沒變就直接載入，不用每次啟動都重新 tokenize
+TOKENIZED_CACHE_DIR = os.path.join(".cache", "tokenized")
+TOKENIZE_NUM_PROC = os.cpu_count()
+
+# 批次組法 (大部分樣本都很短，照順序組 batch 幾乎都是 padding)：
+#   "none"   - 原本的作法，隨機順序，每批補 padding 到最長那筆
+#   "bucket" - 長度相近的樣本排在同一批，padding 大幅減少
+#   "pack"   - 多筆樣本接成一條 (最長 MAX_SEQ_LENGTH)，position_ids 每筆重新從 0 開始，
+#              flash-attention 依此切開注意力邊界，樣本之間不會互相看到。需要 flash_attention_2
+#              每個 epoch 各自依 weight 重新抽樣、打包 (跟 none / bucket 一樣每個 epoch 不同)，
+#              依序接成一份資料，Trainer 只跑 1 個 "epoch" (log 裡的 epoch 會是 0~1)
+BATCHING_MODE = "bucket"
+BUCKET_MEGABATCH = 50  # bucket 模式：每 50 個 batch 為一組，組內依長度排序
+BATCHING_LOG_FILE = os.path.join("outputs", "batching_benchmark.jsonl")  # 每次訓練的吞吐量紀錄
+DATALOADER_WORKERS = 0  # dataloader 子行程數 (0 = 主行程自己組 batch)；要不要加看遙測的 data wait 比例
+
+# 訓練遙測 (train_telemetry.py)：每步的 token/s、dataloader 等待、optimizer 時間、峰值記憶體
+# 寫到 outputs/telemetry/，訓練結束印出摘要
+TELEMETRY = True
+
+def load_train_dataset(path):
+    """回傳 (dataset, instructions)；instructions 不是 None 時，dataset 用 instruction_id 取代 instruction 欄位"""
+    if path.endswith(".arrow"):
+        return Dataset.from_file(path), read_arrow_instructions(path)
+    return load_dataset("json", data_files=path, split="train"), None
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def tokenizer_digest(tokenizer):
+    h = hashlib.sha256()
+    h.update(type(tokenizer).__name__.encode("utf-8"))
+    h.update(json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False).encode("utf-8"))
+    h.update(json.dumps(tokenizer.all_special_tokens, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+def format_chat(instruction, history, inp, out):
+    past = "".join(HISTORY_TEMPLATE.format(input = q, output = a) for q, a in history or [])
+    return CHAT_TEMPLATE.format(instruction = instruction, history = past, input = inp, output = out)
+
+def assistant_only_labels(input_ids, response_ids, end_id):
+    """只保留每個 <|im_start|>assistant\n 之後到 <|im_end|> (含) 的 label，其餘設成 -100"""
+    labels = [-100] * len(input_ids)
+    n = len(response_ids)
+    inside = False
+    i = 0
+    while i < len(input_ids):
+        if not inside and input_ids[i:i + n] == response_ids:
+            inside = True
+            i += n
+            continue
+        if inside:
+            labels[i] = input_ids[i]
+            if input_ids[i] == end_id:
+                inside = False
+        i += 1
+    return labels
+
+def load_tokenized_dataset(path, tokenizer):
+    """回傳含 input_ids / attention_mask / labels / length (和 weight) 的 dataset，優先從快取 memory-map"""
+    key = hashlib.sha256("|".join([
+        tokenizer_digest(tokenizer), CHAT_TEMPLATE, HISTORY_TEMPLATE, LABEL_MODE, file_digest(path), str(MAX_SEQ_LENGTH),
+    ]).encode("utf-8")).hexdigest()[:16]
+    cache_path = os.path.join(TOKENIZED_CACHE_DIR, key)
+    if os.path.exists(cache_path):
+        print(f"⚡ 命中 tokenize 快取: {cache_path}")
+        return load_from_disk(cache_path)
+
+    print(f"🔤 預先 tokenize ({TOKENIZE_NUM_PROC} 個行程)...")
+    dataset, instruction_table = load_train_dataset(path)
+    response_ids = tokenizer(RESPONSE_TEMPLATE, add_special_tokens = False).input_ids
+    end_id = tokenizer.convert_tokens_to_ids("<|im_end|>")
+
+    def tokenize_func(examples):
+        if instruction_table is not None:
+            instructions = [instruction_table[i] for i in examples["instruction_id"]]
+        else:
+            instructions = examples["instruction"]
+        # 多輪對話的每一輪 assistant 回答都會算 loss (assistant_only_labels 會標出每一段)
+        histories = examples["history"] if "history" in examples else [None] * len(instructions)
+        texts = [
+            format_chat(inst, hist, inp, out)
+            for inst, hist, inp, out in zip(instructions, histories, examples["input"], examples["output"])
+        ]
+        tokens = tokenizer(texts, truncation = True, max_length = MAX_SEQ_LENGTH)
+        if LABEL_MODE == "assistant":
+            tokens["labels"] = [assistant_only_labels(ids, response_ids, end_id) for ids in tokens["input_ids"]]
+        else:
+            tokens["labels"] = [list(ids) for ids in tokens["input_ids"]]
+        tokens["length"] = [len(ids) for ids in tokens["input_ids"]]
+        return tokens
+
+    dataset = dataset.map(tokenize_func, batched = True, num_proc = TOKENIZE_NUM_PROC,
+                          remove_columns = [c for c in dataset.column_names if c != "weight"])
+
+    # 先寫到暫存目錄再改名，中途中斷不會留下壞掉的快取
+    tmp_path = cache_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors = True)
+    dataset.save_to_disk(tmp_path)
+    os.replace(tmp_path, cache_path)
+    return load_from_disk(cache_path)
+
+def sample_order(num_samples, weights=None, lengths=None, batch_size=1, seed=3407):
+    """一個 epoch 的樣本順序：有 weight 就依 weight 抽樣 (取代複製資料)，否則打亂；
+    給了 lengths 就把長度相近的樣本排在同一批"""
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    if weights is not None:
+        order = torch.multinomial(torch.tensor(weights, dtype=torch.double), num_samples,
+                                  replacement=True, generator=generator).tolist()
+    else:
+        order = torch.randperm(num_samples, generator=generator).tolist()
+    if lengths is not None:
+        megabatch = batch_size * BUCKET_MEGABATCH
+        order = [i for start in range(0, len(order), megabatch)
+                 for i in sorted(order[start:start + megabatch], key=lambda j: -lengths[j])]
+    return order
+
+class BucketSampler(torch.utils.data.Sampler):
+    """加權抽樣 + 長度分桶，每個 epoch 換一個 seed"""
+    def __init__(self, num_samples, weights=None, lengths=None, batch_size=1, seed=3407):
+        self.num_samples = num_samples
+        self.weights = weights
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self):
+        order = sample_order(self.num_samples, self.weights, self.lengths, self.batch_size, self.seed + self.epoch)
+        self.epoch += 1
+        return iter(order)
+
+    def __len__(self):
+        return self.num_samples
+
+class UruhaSFTTrainer(SFTTrainer):
+    """依 03_dedup_dataset.py 的 weight 抽樣、支援長度分桶，loss 只對 assistant 位置算 logits"""
+    def __init__(self, *args, sample_weights=None, lengths=None, telemetry=None, sequential=False, **kwargs):
+        self.sample_weights = sample_weights
+        self.sample_lengths = lengths
+        self.sequential = sequential  # pack 模式：資料已經依 epoch 排好，照順序讀
+        self.telemetry = telemetry
+        if telemetry is not None:
+            kwargs["callbacks"] = list(kwargs.get("callbacks") or []) + [telemetry]
+        super().__init__(*args, **kwargs)
+
+    def get_batch_samples(self, epoch_iterator, num_batches, *args, **kwargs):
+        # callback 看不到 batch，在這裡量 dataloader 等待時間並回報 token 數
+        start = time.perf_counter()
+        batch_samples, num_items_in_batch = super().get_batch_samples(epoch_iterator, num_batches, *args, **kwargs)
+        if self.telemetry is not None:
+            self.telemetry.on_batches_fetched(batch_samples, time.perf_counter() - start)
+        return batch_samples, num_items_in_batch
+
+    def _get_train_sampler(self, *args, **kwargs):
+        if self.sequential:
+            return torch.utils.data.SequentialSampler(self.train_dataset)
+        if self.sample_weights is None and self.sample_lengths is None:
+            return super()._get_train_sampler(*args, **kwargs)
+        return BucketSampler(len(self.train_dataset), self.sample_weights, self.sample_lengths,
+                             self.args.per_device_train_batch_size, self.args.seed)
+
+    def compute_loss(self, model, inputs, return_outputs = False, num_items_in_batch = None, **kwargs):
+        if not SKIP_PROMPT_LOGITS or return_outputs:
+            return super().compute_loss(model, inputs, return_outputs = return_outputs,
+                                        num_items_in_batch = num_items_in_batch, **kwargs)
+        loss, num_tokens = assistant_lm_loss(model, inputs)
+        # 跟 Trainer 的慣例一致：模型吃 loss kwargs 時用整個累積批次的 token 數平均，否則用本批平均 (Trainer 會再除以累積步數)
+        if num_items_in_batch is not None and getattr(self, "model_accepts_loss_kwargs", False):
+            return loss / num_items_in_batch
+        return loss / num_tokens.clamp(min = 1)
+
+def assistant_lm_loss(model, inputs):
+    """只對 label != -100 的位置做 lm_head，回傳 (loss 總和, 算 loss 的 token 數)"""
+    inputs = dict(inputs)
+    labels = inputs.pop("labels")
+    # PEFT 包裝下拿到 CausalLM 本體，只跑 decoder 拿 hidden state，不經過 lm_head
+    causal_lm = model.get_base_model() if hasattr(model, "get_base_model") else model
+    hidden = causal_lm.model(**inputs, use_cache = False)[0]
+    shift_labels = labels[:, 1:]
+    keep = shift_labels != -100
+    # 只有 assistant 的位置才做 lm_head
+    logits = causal_lm.lm_head(hidden[:, :-1][keep])
+    loss = torch.nn.functional.cross_entropy(logits.float(), shift_labels[keep], reduction = "sum")
+    return loss, keep.sum()
+
+def probe_loss(model, inputs):
+    """batch 自動調整用：跟訓練時同一條 loss 路徑 (記憶體用量才會一樣)"""
+    if SKIP_PROMPT_LOGITS:
+        loss, num_tokens = assistant_lm_loss(model, inputs)
+        return loss / num_tokens.clamp(min = 1)
+    return model(**inputs).loss
+
+def pack_dataset(dataset, lengths, weights=None, seed=3407):
+    """把一個 epoch 的樣本 (依 weight 抽好) 用 first-fit-decreasing 裝進長度 MAX_SEQ_LENGTH 的箱子"""
+    order = sample_order(len(dataset), weights, seed=seed)
+    order.sort(key=lambda i: -lengths[i])
+    bins, bin_space = [], []
+    for i in order:
+        for b, space in enumerate(bin_space):
+            if lengths[i] <= space:
+                bins[b].append(i)
+                bin_space[b] -= lengths[i]
+                break
+        else:
+            bins.append([i])
+            bin_space.append(MAX_SEQ_LENGTH - lengths[i])
+    random.Random(seed).shuffle(bins)
+
+    all_ids = dataset["input_ids"]
+    all_labels = dataset["labels"]
+    packed = {"input_ids": [], "position_ids": [], "labels": []}
+    for members in bins:
+        input_ids, position_ids, labels = [], [], []
+        for i in members:
+            ids = all_ids[i]
+            input_ids += ids
+            position_ids += range(len(ids))
+            labels += [-100] + all_labels[i][1:]  # 每筆的第一個 token 不去預測上一筆的結尾
+        packed["input_ids"].append(input_ids)
+        packed["position_ids"].append(position_ids)
+        packed["labels"].append(labels)
+    return Dataset.from_dict(packed)
+
+def packed_collator(features):
+    # batch size 固定 1：不需要 attention_mask，靠 position_ids 歸零的位置切開樣本邊界
+    return {k: torch.tensor([f[k] for f in features]) for k in ("input_ids", "position_ids", "labels")}
+
+def padding_report(lengths, weights, batch_size):
+    """估算每種批次組法的 padding 比例 (padding token / 總 token)"""
+    report = {}
+    for mode in ("none", "bucket"):
+        order = sample_order(len(lengths), weights, lengths if mode == "bucket" else None, batch_size)
+        real = padded = 0
+        for start in range(0, len(order), batch_size):
+            batch = [lengths[i] for i in order[start:start + batch_size]]
+            real += sum(batch)
+            padded += max(batch) * len(batch)
+        report[mode] = 1 - real / padded
+    report["pack"] = 0.0  # 接成一條，不需要 padding
+    return report
 
 def main():
     print("🚀 [Training V14] 3 Epochs 進階訓練模式啟動...")
@@ -121,58 +333,120 @@ def main():
     print("🔧 配置 LoRA...")
     model = FastLanguageModel.get_peft_model(
         model,
-        r = 16, 
-        target_modules = ["q_proj", "k_proj", "v_proj", "o_proj",
-                          "gate_proj", "up_proj", "down_proj"],
-        lora_alpha = 16,
+        r = LORA_R, 
+        target_modules = LORA_TARGET_MODULES,
+        lora_alpha = LORA_ALPHA,
         lora_dropout = 0, 
         bias = "none", 
-        use_gradient_checkpointing = "unsloth", 
+        use_gradient_checkpointing = GRADIENT_CHECKPOINTING, 
         random_state = 3407,
     )
 
-    # 載入數據
+    # 載入數據 (已 tokenize，快取命中時直接 memory-map)
     print("📂 載入數據集...")
-    dataset = load_dataset("json", data_files="uruha_clean_train.json", split="train")
-
-    def formatting_prompts_func(examples):
-        instructions = examples["instruction"]
-        inputs       = examples["input"]
-        outputs      = examples["output"]
-        texts = []
-        for inst, inp, out in zip(instructions, inputs, outputs):
-            text = f"<|im_start|>system\n{inst}<|im_end|>\n<|im_start|>user\n{inp}<|im_end|>\n<|im_start|>assistant\n{out}<|im_end|>"
-            texts.append(text)
-        return { "text" : texts }
-
-    dataset = dataset.map(formatting_prompts_func, batched = True,)
-    
+    dataset = load_tokenized_dataset(TRAIN_FILE, tokenizer)
+    lengths = dataset["length"]
+    dataset = dataset.remove_columns("length")
+
+    sample_weights = dataset["weight"] if "weight" in dataset.column_names else None
+    if sample_weights is not None:
+        print(f"⚖️ 使用加權抽樣 (權重總和 {sum(sample_weights)}，每個 Epoch 抽 {len(dataset)} 筆)")
+
+    batching_mode = BATCHING_MODE
+    if batching_mode == "pack" and getattr(model.config, "_attn_implementation", None) != "flash_attention_2":
+        print("⚠️ pack 模式需要 flash_attention_2 才能切開樣本邊界，改用 bucket 模式")
+        batching_mode = "bucket"
+
+    # 事前估算：每種組法的 padding 比例
+    ratios = padding_report(lengths, sample_weights, BATCH_SIZE)
+    print(f"📏 平均長度 {sum(lengths) / len(lengths):.0f} tokens，最長 {max(lengths)} tokens")
+    for mode, ratio in ratios.items():
+        mark = "👉" if mode == batching_mode else "  "
+        print(f"   {mark} {mode:<6} padding 比例: {ratio:6.1%}")
+
+    batch_size, grad_accum = BATCH_SIZE, GRAD_ACCUM
+    data_collator = DataCollatorForSeq2Seq(tokenizer, padding = True, label_pad_token_id = -100)
+    train_epochs = NUM_EPOCHS
+    if batching_mode == "pack":
+        # 每個 epoch 用不同 seed 重新抽樣打包，再依序接起來 (Trainer 只跑 1 輪)
+        train_dataset = concatenate_datasets([
+            pack_dataset(dataset, lengths, sample_weights, seed = 3407 + epoch) for epoch in range(NUM_EPOCHS)
+        ])
+        train_epochs = 1
+        samples_per_pack = len(dataset) * NUM_EPOCHS / len(train_dataset)
+        # 一條 pack 已經裝了很多筆，調整累積步數讓每次更新看到的樣本數接近原本的 8 筆
+        batch_size, grad_accum = 1, max(1, round(BATCH_SIZE * GRAD_ACCUM / samples_per_pack))
+        data_collator = packed_collator
+        print(f"📦 打包: 每個 Epoch {len(dataset)} 筆 -> 共 {len(train_dataset)} 條 ({NUM_EPOCHS} 個 Epoch，平均每條 {samples_per_pack:.1f} 筆)")
+        tokens_per_epoch = sum(len(ids) for ids in train_dataset["input_ids"]) / NUM_EPOCHS
+        trainer_weights, trainer_lengths = None, None
+    else:
+        train_dataset = dataset.remove_columns("weight") if sample_weights is not None else dataset
+        if sample_weights is not None:
+            tokens_per_epoch = len(lengths) * sum(w * l for w, l in zip(sample_weights, lengths)) / sum(sample_weights)
+        else:
+            tokens_per_epoch = sum(lengths)
+        trainer_weights = sample_weights
+        trainer_lengths = lengths if batching_mode == "bucket" else None
+
+        if AUTOTUNE_BATCH:
+            # 最壞情況：最長的 b 筆排在同一批 (分桶後真的會發生)
+            longest = sorted(range(len(lengths)), key = lambda i: -lengths[i])
+            def make_batch(b):
+                batch = data_collator([train_dataset[i] for i in longest[:b]])
+                return {k: v.to(model.device) for k, v in batch.items()}
+            fingerprint = {
+                "model": model.config._name_or_path, "load_in_4bit": LOAD_IN_4BIT,
+                "dtype": str(DTYPE or model.dtype),  # DTYPE = None 時用 Unsloth 實際選的
+                "lora_r": LORA_R, "lora_target_modules": sorted(LORA_TARGET_MODULES),
+                "gradient_checkpointing": GRADIENT_CHECKPOINTING,
+                "max_seq_length": MAX_SEQ_LENGTH, "longest_sample": max(lengths),
+                "label_mode": LABEL_MODE, "skip_prompt_logits": SKIP_PROMPT_LOGITS,
+                "batching_mode": batching_mode,
+            }
+            batch_size, grad_accum = autotune_batch_size(model, probe_loss, make_batch, BATCH_SIZE * GRAD_ACCUM,
+                                                         fingerprint, BATCH_SIZE)
+            if batch_size != BATCH_SIZE:
+                ratios = padding_report(lengths, sample_weights, batch_size)
+                print(f"📏 batch {batch_size} 時 {batching_mode} 的 padding 比例: {ratios[batching_mode]:6.1%}")
+
     # 計算總步數
-    total_steps_per_epoch = len(dataset) // (2 * 4) # batch_size 2 * grad_accum 4 = 8
-    print(f"🔥 開始訓練 (資料量: {len(dataset)})")
-    print(f"💡 預計每個 Epoch 步數: {total_steps_per_epoch}")
-    print(f"💡 總 Epochs: 3 (總步數約 {total_steps_per_epoch * 3})")
+    total_steps = len(train_dataset) // (batch_size * grad_accum) * train_epochs
+    print(f"🔥 開始訓練 (資料量: {len(train_dataset)})")
+    print(f"💡 預計每個 Epoch 步數: {total_steps // NUM_EPOCHS}")
+    print(f"💡 總 Epochs: {NUM_EPOCHS} (總步數約 {total_steps})")
+
+    telemetry = None
+    if TELEMETRY:
+        telemetry = TelemetryCallback(output_dir = "outputs", run_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{batching_mode}")
+        telemetry.extra = {"mode": batching_mode, "batch_size": batch_size, "grad_accum": grad_accum,
+                           "dataloader_workers": DATALOADER_WORKERS}
     
-    trainer = SFTTrainer(
+    trainer = UruhaSFTTrainer(
         model = model,
         tokenizer = tokenizer,
-        train_dataset = dataset,
-        dataset_text_field = "text",
+        train_dataset = train_dataset,
         max_seq_length = MAX_SEQ_LENGTH,
-        dataset_num_proc = 2,
+        data_collator = data_collator,
+        dataset_kwargs = {"skip_prepare_dataset": True},  # 已經預先 tokenize 好了
         packing = False, 
+        sample_weights = trainer_weights,
+        lengths = trainer_lengths,
+        telemetry = telemetry,
+        sequential = batching_mode == "pack",
         args = TrainingArguments(
-            per_device_train_batch_size = 2,
-            gradient_accumulation_steps = 4,
+            per_device_train_batch_size = batch_size,
+            gradient_accumulation_steps = grad_accum,
             warmup_steps = 5,
             
-            # 🔥 關鍵修改：3 個 Epochs
-            num_train_epochs = 3, 
+            # 🔥 關鍵修改：3 個 Epochs (pack 模式已經把 3 個 Epoch 接成一份)
+            num_train_epochs = train_epochs, 
             
             learning_rate = 2e-4,
             fp16 = not torch.cuda.is_bf16_supported(),
             bf16 = torch.cuda.is_bf16_supported(),
             logging_steps = 10, 
+            dataloader_num_workers = DATALOADER_WORKERS,
             optim = "adamw_8bit",
             weight_decay = 0.01,
             lr_scheduler_type = "linear",
@@ -187,7 +461,32 @@ def main():
     )
 
     trainer_stats = trainer.train()
-    print(f"✅ 訓練完成！耗時: {trainer_stats.metrics['train_runtime']} 秒")
+    runtime = trainer_stats.metrics['train_runtime']
+    print(f"✅ 訓練完成！耗時: {runtime} 秒")
+
+    # 吞吐量紀錄：換 BATCHING_MODE 重跑就能比較前後差異
+    record = {
+        "mode": batching_mode,
+        "padding_ratio": round(ratios[batching_mode], 4),
+        "tokens_per_sec": round(tokens_per_epoch * NUM_EPOCHS / runtime, 1),
+        "samples_per_sec": round(len(dataset) * NUM_EPOCHS / runtime, 2),
+        "batch_size": batch_size,
+        "grad_accum": grad_accum,
+    }
+    if telemetry is not None and telemetry.rows:
+        # 遙測量到的實際值 (略過暖機步)，padding 與 dataloader 等待分開看
+        summary = telemetry.summary()
+        record["measured_tokens_per_sec"] = round(summary["tokens_per_sec"], 1)
+        record["measured_pad_tokens_per_sec"] = round(summary["pad_tokens_per_sec"], 1)
+        record["data_wait_ratio"] = round(summary["data_wait_ratio"], 4)
+    os.makedirs(os.path.dirname(BATCHING_LOG_FILE), exist_ok = True)
+    with open(BATCHING_LOG_FILE, "a", encoding = "utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    print("📈 吞吐量紀錄 (有效 token，不含 padding):")
+    with open(BATCHING_LOG_FILE, "r", encoding = "utf-8") as f:
+        for line in f:
+            r = json.loads(line)
+            print(f"   {r['mode']:<6} padding {r['padding_ratio']:6.1%} | {r['tokens_per_sec']:>9} tokens/s | {r['samples_per_sec']:>7} samples/s")
     
     print("💾 儲存最終結果...")
     model.save_pretrained("uruha_lora_adapters")
@@ -1,104 +1,272 @@
-import sys
-import os
-import types
-import importlib.util
-import importlib.machinery
-import torch
-import time
+import runtime_bootstrap
 
 # =================================================================
 # 🛡️ Windows 防禦系統 (Inference V2 Edition)
-# 採用與訓練腳本相同的全套防禦邏輯，確保模組連接正確
+# 採用與訓練腳本相同的全套防禦邏輯 (runtime_bootstrap/)，確保模組連接正確
 # =================================================================
 
-os.environ["UNSLOTH_COMPILE_DISABLE"] = "1"
-os.environ["UNSLOTH_NO_model_card"] = "1"
-
-# 1. 🔥 智慧轉接頭 V3 (AMP Polyfills)
-try:
-    if not hasattr(torch.amp, "custom_fwd"):
-        from torch.cuda.amp import custom_fwd as legacy_fwd
-        from torch.cuda.amp import custom_bwd as legacy_bwd
-
-        def smart_custom_fwd(*args, **kwargs):
-            if "device_type" in kwargs or len(args) == 0:
-                def decorator(func): return legacy_fwd(func)
-                return decorator
-            return legacy_fwd(*args, **kwargs)
-
-        def smart_custom_bwd(*args, **kwargs):
-            if "device_type" in kwargs or len(args) == 0:
-                def decorator(func): return legacy_bwd(func)
-                return decorator
-            return legacy_bwd(*args, **kwargs)
-
-        torch.amp.custom_fwd = smart_custom_fwd
-        torch.amp.custom_bwd = smart_custom_bwd
-
-    if not hasattr(torch.amp, "is_autocast_available"):
-        def mock_is_autocast_available(device_type):
-            return device_type == "cuda"
-        torch.amp.is_autocast_available = mock_is_autocast_available
-
-except Exception as e: pass
-
-# 2. 閹割 torch.compile
-def dummy_compile(model=None, *, fullgraph=False, dynamic=False, backend="inductor", mode=None, options=None, disable=False):
-    def decorator(func): return func
-    if model and callable(model): return model
-    return decorator
-torch.compile = dummy_compile
-
-# 3. 偽造 torch._inductor (關鍵修復：確保父子模組正確連接)
-try:
-    class MockConfig:
-        def is_fbcode(self): return False
-    class MockDeviceProperties:
-        def __init__(self, *args, **kwargs): pass
-
-    mock_modules = [
-        "torch._inductor", "torch._inductor.config", 
-        "torch._inductor.runtime", "torch._inductor.runtime.hints",
-        "torch._inductor.test_operators", "torch._inductor.utils"
-    ]
-    for mod_name in mock_modules:
-        m = types.ModuleType(mod_name)
-        if mod_name == "torch._inductor.config": m.is_fbcode = lambda: False
-        sys.modules[mod_name] = m
-        # 🔥 這一步非常重要：把子模組掛回父模組身上
-        if "." in mod_name:
-            parent, child = mod_name.rsplit(".", 1)
-            if parent in sys.modules: setattr(sys.modules[parent], child, m)
-
-    sys.modules["torch._inductor.runtime.hints"].DeviceProperties = MockDeviceProperties
-    if not hasattr(torch, "_inductor"): setattr(torch, "_inductor", sys.modules["torch._inductor"])
-except Exception as e: pass
-
-# 4. 偽造 torchvision
-try:
-    if "torchvision" not in sys.modules:
-        m_tv = types.ModuleType("torchvision")
-        m_tv.__spec__ = importlib.machinery.ModuleSpec(name="torchvision", loader=None)
-        m_tv.__version__ = "0.19.1" 
-        m_ops = types.ModuleType("torchvision.ops")
-        m_ops.__spec__ = importlib.machinery.ModuleSpec(name="torchvision.ops", loader=None)
-        m_ops.nms = lambda *args, **kwargs: args[0]
-        m_tv.ops = m_ops
-        sys.modules["torchvision"] = m_tv
-        sys.modules["torchvision.ops"] = m_ops
-except Exception as e: pass
+runtime_bootstrap.install()
+
+import os
+import torch
+import time
 
 # =================================================================
 # 測試邏輯開始
 # =================================================================
 
-from unsloth import FastLanguageModel
+from transformers import DynamicCache
+from transformers.generation.logits_process import LogitsProcessorList, TemperatureLogitsWarper, TopPLogitsWarper
+from collections import OrderedDict, deque
+import copy
+import csv
+import json
 
 # 設定
 MAX_SEQ_LENGTH = 2048
 DTYPE = None
 LOAD_IN_4BIT = True
 ADAPTER_PATH = "uruha_lora_adapters" 
+PREFIX_CACHE_SIZE = 4  # 最多同時保留幾個 system prompt 的 KV (LRU 淘汰)
+EVAL_BATCH_SIZE = 8    # 同時生成幾題；設 1 就等於原本一題一題跑
+MAX_NEW_TOKENS = 256
+REPORT_FILE = "uruha_multilingual_report.txt"
+TIMING_FILE = "uruha_multilingual_timing.csv"  # 每題延遲與 tokens/sec
+
+# 沒有 GPU 的機器走 CPU：bitsandbytes 4-bit 只支援 CUDA，改用 transformers + peft 載入非量化的基底模型
+if torch.cuda.is_available():
+    DEVICE = "cuda"
+elif getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+    DEVICE = "mps"
+else:
+    DEVICE = "cpu"
+
+if DEVICE == "cuda":
+    from unsloth import FastLanguageModel
+
+runtime_bootstrap.report()
+
+def load_model():
+    if DEVICE == "cuda":
+        model, tokenizer = FastLanguageModel.from_pretrained(
+            model_name = ADAPTER_PATH,
+            max_seq_length = MAX_SEQ_LENGTH,
+            dtype = DTYPE,
+            load_in_4bit = LOAD_IN_4BIT,
+        )
+        FastLanguageModel.for_inference(model)
+        return model, tokenizer
+
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from peft import PeftModel
+    with open(os.path.join(ADAPTER_PATH, "adapter_config.json"), "r", encoding="utf-8") as f:
+        base_model = json.load(f)["base_model_name_or_path"]
+    base_model = base_model.replace("-bnb-4bit", "")
+    print(f"💻 沒有 CUDA，改用 {DEVICE} 載入 {base_model} + LoRA")
+    tokenizer = AutoTokenizer.from_pretrained(ADAPTER_PATH)
+    model = AutoModelForCausalLM.from_pretrained(
+        base_model, torch_dtype = torch.float32 if DEVICE == "cpu" else torch.float16,
+    ).to(DEVICE)
+    model = PeftModel.from_pretrained(model, ADAPTER_PATH)
+    model.eval()
+    return model, tokenizer
+
+class PrefixKVCache:
+    """system prompt 的 KV 只 prefill 一次，之後每一題複製一份接著用 (generate 會改動 cache，不能共用同一份)"""
+    def __init__(self, model, tokenizer, max_entries=PREFIX_CACHE_SIZE):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # prefix 文字 -> (prefix input_ids, past_key_values)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, prefix):
+        if prefix in self.entries:
+            self.entries.move_to_end(prefix)
+            self.hits += 1
+        else:
+            self.misses += 1
+            ids = self.tokenizer([prefix], return_tensors="pt", add_special_tokens=False).input_ids.to(self.model.device)
+            with torch.no_grad():
+                out = self.model(input_ids=ids, use_cache=True)
+            self.entries[prefix] = (ids, out.past_key_values)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        ids, past_key_values = self.entries[prefix]
+        return ids, copy.deepcopy(past_key_values)
+
+def kv_tensors(cache):
+    """把各版本 transformers 的 cache 統一成 [(key, value), ...]，形狀 [batch, heads, seq, dim]"""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, "key_cache"):
+        return list(zip(cache.key_cache, cache.value_cache))
+    return [(k, v) for k, v in cache]
+
+def build_cache(tensors):
+    cache = DynamicCache()
+    for layer_idx, (k, v) in enumerate(tensors):
+        cache.update(k, v, layer_idx)
+    return cache
+
+class BatchedGenerator:
+    """連續批次生成：有題目答完就立刻補下一題進來，不用等整批最慢的那題。
+
+    每一列都是 [system prefix | padding | 使用者這一輪 | 已生成的 token]。
+    prefix 的 KV 所有列共用同一個位置，padding 放在 prefix 後面 (相當於使用者這一輪的 left padding)，
+    attention_mask 遮掉 padding，position_ids 另外算，所以 padding 不影響結果。
+    """
+    def __init__(self, model, tokenizer, prefix_cache, batch_size=EVAL_BATCH_SIZE, max_new_tokens=MAX_NEW_TOKENS,
+                 temperature=0.6, top_p=0.9, repetition_penalty=1.1):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefix_cache = prefix_cache
+        self.batch_size = batch_size
+        self.max_new_tokens = max_new_tokens
+        self.repetition_penalty = repetition_penalty
+        self.warpers = LogitsProcessorList([TemperatureLogitsWarper(temperature), TopPLogitsWarper(top_p)])
+        self.stop_ids = {tokenizer.eos_token_id, tokenizer.convert_tokens_to_ids("<|im_end|>")} - {None}
+        self.pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.device = model.device
+
+    def _sample(self, logits, seen):
+        # repetition penalty：出現過的 token (含 prompt) 正分除以 penalty、負分乘以 penalty
+        logits = logits.float()
+        penalized = torch.where(logits > 0, logits / self.repetition_penalty, logits * self.repetition_penalty)
+        logits = torch.where(seen, penalized, logits)
+        probs = torch.softmax(self.warpers(None, logits), dim=-1)
+        return torch.multinomial(probs, 1).squeeze(1)
+
+    def _pad_middle(self, kv, mask, extra):
+        """在 prefix 後面插入 extra 格空位 (mask = 0)，讓不同長度的列可以接在一起"""
+        if extra == 0:
+            return kv, mask
+        lp = self.prefix_len
+        def widen(t):
+            gap = t.new_zeros(t.shape[0], t.shape[1], extra, t.shape[3])
+            return torch.cat([t[:, :, :lp], gap, t[:, :, lp:]], dim=2)
+        kv = [(widen(k), widen(v)) for k, v in kv]
+        mask = torch.cat([mask[:, :lp], mask.new_zeros(mask.shape[0], extra), mask[:, lp:]], dim=1)
+        return kv, mask
+
+    def _admit(self, system_block, jobs):
+        """把新題目 prefill 進 batch：共用 prefix KV，只算使用者這一輪"""
+        prefix_ids, prefix_kv = self.prefix_cache.get(system_block)
+        self.prefix_len = lp = prefix_ids.shape[1]
+        n = len(jobs)
+        user_ids = [
+            self.tokenizer(f"<|im_start|>user\n{q}<|im_end|>\n<|im_start|>assistant\n", add_special_tokens=False).input_ids
+            for _, q in jobs
+        ]
+        lu = max(len(u) for u in user_ids)
+        ids = torch.full((n, lu), self.pad_id, dtype=torch.long, device=self.device)
+        user_mask = torch.zeros((n, lu), dtype=torch.long, device=self.device)
+        for r, u in enumerate(user_ids):
+            ids[r, lu - len(u):] = torch.tensor(u, device=self.device)
+            user_mask[r, lu - len(u):] = 1
+        mask = torch.cat([torch.ones((n, lp), dtype=torch.long, device=self.device), user_mask], dim=1)
+        position_ids = (lp + user_mask.cumsum(dim=1) - 1).clamp(min=lp)
+        cache = build_cache([(k.expand(n, -1, -1, -1).contiguous(), v.expand(n, -1, -1, -1).contiguous())
+                             for k, v in kv_tensors(prefix_kv)])
+        started = time.perf_counter()
+        with torch.no_grad():
+            out = self.model(input_ids=ids, attention_mask=mask, position_ids=position_ids,
+                             past_key_values=cache, use_cache=True)
+        kv = kv_tensors(out.past_key_values)
+        logits = out.logits[:, -1, :]
+
+        seen = torch.zeros((n, logits.shape[-1]), dtype=torch.bool, device=self.device)
+        seen[:, prefix_ids[0]] = True
+        for r, u in enumerate(user_ids):
+            seen[r, torch.tensor(u, device=self.device)] = True
+        next_pos = lp + user_mask.sum(dim=1)
+
+        if not self.rows:
+            self.kv, self.mask, self.seen, self.next_pos = kv, mask, seen, next_pos
+        else:
+            width = self.mask.shape[1]
+            self.kv, self.mask = self._pad_middle(self.kv, self.mask, max(0, mask.shape[1] - width))
+            kv, mask = self._pad_middle(kv, mask, max(0, width - mask.shape[1]))
+            self.kv = [(torch.cat([k1, k2]), torch.cat([v1, v2])) for (k1, v1), (k2, v2) in zip(self.kv, kv)]
+            self.mask = torch.cat([self.mask, mask])
+            self.seen = torch.cat([self.seen, seen])
+            self.next_pos = torch.cat([self.next_pos, next_pos])
+        for index, question in jobs:
+            self.rows.append({"index": index, "question": question, "tokens": [], "start": started, "ttft": None})
+        self._emit(logits, new_rows=n)
+
+    def _emit(self, logits, new_rows=None):
+        """抽下一個 token；new_rows 有值時，logits 只對應最後 new_rows 列 (剛 prefill 完的新題目)"""
+        offset = 0 if new_rows is None else len(self.rows) - new_rows
+        tokens = self._sample(logits, self.seen[offset:])
+        now = time.perf_counter()
+        for r, token in enumerate(tokens.tolist()):
+            row = self.rows[offset + r]
+            row["tokens"].append(token)
+            if row["ttft"] is None:
+                row["ttft"] = now - row["start"]
+            self.seen[offset + r, token] = True
+        self.last_tokens = tokens if offset == 0 else torch.cat([self.last_tokens, tokens])
+
+    def _retire(self):
+        """答完的題目 (遇到結束符號或超過長度) 移出 batch"""
+        now = time.perf_counter()
+        keep = []
+        for r, row in enumerate(self.rows):
+            if row["tokens"][-1] in self.stop_ids or len(row["tokens"]) >= self.max_new_tokens:
+                latency = now - row["start"]
+                self.results[row["index"]] = {
+                    "question": row["question"],
+                    "answer": self.tokenizer.decode(row["tokens"], skip_special_tokens=True),
+                    "latency": latency,
+                    "ttft": row["ttft"],
+                    "new_tokens": len(row["tokens"]),
+                    "tokens_per_sec": len(row["tokens"]) / latency if latency > 0 else 0.0,
+                }
+            else:
+                keep.append(r)
+        if len(keep) == len(self.rows):
+            return
+        self.rows = [self.rows[r] for r in keep]
+        if not keep:
+            return
+        idx = torch.tensor(keep, device=self.device)
+        self.kv = [(k.index_select(0, idx), v.index_select(0, idx)) for k, v in self.kv]
+        self.mask = self.mask.index_select(0, idx)
+        self.seen = self.seen.index_select(0, idx)
+        self.next_pos = self.next_pos.index_select(0, idx)
+        self.last_tokens = self.last_tokens.index_select(0, idx)
+        # 所有列都是 padding 的欄位可以直接丟掉，省下之後每一步的注意力計算
+        columns = self.mask.bool().any(dim=0)
+        if not columns.all():
+            cols = columns.nonzero().squeeze(1)
+            self.kv = [(k.index_select(2, cols), v.index_select(2, cols)) for k, v in self.kv]
+            self.mask = self.mask.index_select(1, cols)
+
+    def _step(self):
+        """所有進行中的題目一起往前生成一個 token"""
+        self.mask = torch.cat([self.mask, self.mask.new_ones(self.mask.shape[0], 1)], dim=1)
+        with torch.no_grad():
+            out = self.model(input_ids=self.last_tokens[:, None], attention_mask=self.mask,
+                             position_ids=self.next_pos[:, None], past_key_values=build_cache(self.kv), use_cache=True)
+        self.kv = kv_tensors(out.past_key_values)
+        self.next_pos = self.next_pos + 1
+        self._emit(out.logits[:, -1, :])
+
+    def run(self, system_block, questions):
+        self.rows = []
+        self.results = [None] * len(questions)
+        queue = deque(enumerate(questions))
+        while queue or self.rows:
+            free = self.batch_size - len(self.rows)
+            if free > 0 and queue:
+                self._admit(system_block, [queue.popleft() for _ in range(min(free, len(queue)))])
+                self._retire()
+                continue
+            self._step()
+            self._retire()
+        return self.results
 
 # 30 個混合語言壓力測試題
 test_questions = [
@@ -150,15 +318,9 @@ def main():
     print("🎯 目標：輸入(中/日/英) -> 輸出(絕對日文)")
     
     try:
-        model, tokenizer = FastLanguageModel.from_pretrained(
-            model_name = ADAPTER_PATH,
-            max_seq_length = MAX_SEQ_LENGTH,
-            dtype = DTYPE,
-            load_in_4bit = LOAD_IN_4BIT,
-        )
-        FastLanguageModel.for_inference(model) 
+        model, tokenizer = load_model()
         
-        print("✅ 模型載入成功！開始 30 題混合語言連發測試...")
+        print(f"✅ 模型載入成功！開始 30 題混合語言連發測試 (裝置: {DEVICE}, batch: {EVAL_BATCH_SIZE})...")
         print("="*60)
         
         results = []
@@ -176,38 +338,38 @@ def main():
 2.  **文脈維持**: ユーザーの質問に対して、**直接的かつ論理的に**答えてください。関係のない話（配信の挨拶やボーナスの話など）はしないでください。
 3.  **SuperChat禁止**: スパチャ読みや、架空のリスナーへの感謝（「〇〇さんありがとう」等）は**絶対にしないでください**。あなたは今、目の前のユーザーと1対1で会話しています。"""
 
-        for i, question in enumerate(test_questions):
-            # 去掉前面的 [CN] 標籤
-            clean_question = question.split("] ")[1] if "] " in question else question
-            
+        prefix_cache = PrefixKVCache(model, tokenizer)
+        system_block = f"<|im_start|>system\n{system_prompt}<|im_end|>\n"
+        engine = BatchedGenerator(model, tokenizer, prefix_cache)
+
+        # 去掉前面的 [CN] 標籤
+        clean_questions = [q.split("] ")[1] if "] " in q else q for q in test_questions]
+
+        started = time.perf_counter()
+        answers = engine.run(system_block, clean_questions)
+        wall_time = time.perf_counter() - started
+
+        for i, (question, item) in enumerate(zip(test_questions, answers)):
             print(f"❓ [Q{i+1}/30]: {question}")
-            
-            # 構建 Prompt
-            prompt = f"<|im_start|>system\n{system_prompt}<|im_end|>\n<|im_start|>user\n{clean_question}<|im_end|>\n<|im_start|>assistant\n"
-            
-            inputs = tokenizer([prompt], return_tensors = "pt").to("cuda")
-            
-            outputs = model.generate(
-                **inputs, 
-                max_new_tokens = 256,
-                use_cache = True,
-                temperature = 0.6,
-                top_p = 0.9,
-                repetition_penalty = 1.1
-            )
-            
-            generated_ids = outputs[0][inputs['input_ids'].shape[-1]:]
-            response = tokenizer.decode(generated_ids, skip_special_tokens=True)
-            
-            print(f"💬 [Uruha]: {response}")
+            print(f"💬 [Uruha]: {item['answer']}")
+            print(f"⏱️ 延遲 {item['latency']:.2f} s | 首字 {item['ttft'] * 1000:.0f} ms | {item['tokens_per_sec']:.1f} tokens/s")
             print("-" * 30)
-            
-            results.append(f"Q: {question}\nA: {response}\n")
+            results.append(f"Q: {question}\nA: {item['answer']}\n")
 
-        with open("uruha_multilingual_report.txt", "w", encoding="utf-8") as f:
+        with open(REPORT_FILE, "w", encoding="utf-8") as f:
             f.write("\n".join(results))
-            
-        print(f"🎉 測試完成！請查看 'uruha_multilingual_report.txt'")
+
+        with open(TIMING_FILE, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["question", "latency_s", "ttft_ms", "new_tokens", "tokens_per_sec"])
+            for question, item in zip(test_questions, answers):
+                writer.writerow([question, f"{item['latency']:.3f}", f"{item['ttft'] * 1000:.0f}",
+                                 item["new_tokens"], f"{item['tokens_per_sec']:.2f}"])
+
+        total_tokens = sum(item["new_tokens"] for item in answers)
+        print(f"⏱️ 總耗時 {wall_time:.1f} s，共生成 {total_tokens} tokens ({total_tokens / wall_time:.1f} tokens/s)")
+        print(f"   prefix 快取命中 {prefix_cache.hits} 次 / 未命中 {prefix_cache.misses} 次")
+        print(f"🎉 測試完成！請查看 '{REPORT_FILE}' 與 '{TIMING_FILE}'")
 
     except Exception as e:
         print(f"❌ 測試發生錯誤: {e}")
@@ -0,0 +1,209 @@
+import os
+import gc
+import json
+import time
+import hashlib
+import platform
+import threading
+import torch
+
+# =================================================================
+# 🔧 自動找 batch size / gradient accumulation (04_train.py)
+# 有效 batch (batch size × 累積步數) 固定，從小到大試 batch size：
+#   用資料裡「最長的那幾筆」組成一批 (分桶後最壞的情況)，真的跑一次 forward + backward，
+#   量這一步的峰值記憶體，超過上限 (或預估下一個會超過、或直接 OOM) 就停，取最後一個成功的。
+# CUDA 看 max_memory_allocated；CPU 沒有 OOM 例外 (會被 OS 砍掉或開始 swap)，
+#   改成用背景執行緒取樣 RSS，而且每次都先線性外推，預估會爆就不試。
+# 結果依 模型 / LoRA / dtype / 序列長度 / 資料最長長度 / 硬體 指紋快取在 .cache/batch_autotune.json，下次直接用。
+#
+# 實測跟真正訓練的差距 (由 DEVICE_HEADROOM 的 15% 吸收，不另外估算)：
+#   - 試跑沒有經過 Trainer，所以沒有 fp16 / bf16 autocast：activation 的 dtype 可能跟訓練時不同
+#   - 只有 forward + backward，沒有 optimizer.step()：optimizer state 還沒配置
+#     (LoRA + adamw_8bit 只有 adapter 參數的 2 份 8-bit 狀態，通常不到 100 MB)
+#
+# 註：unsloth_compiled_cache/*Trainer.py 也有 autotune_batch_and_chunks，
+#     但只在 torch.cuda.is_available() 時才設定 limit_gb，CPU 上會 NameError；
+#     那些是 Unsloth 自動產生的檔案 (改了會被覆蓋)，所以不動它，改用這裡的實測版本。
+# =================================================================
+
+AUTOTUNE_CACHE = os.path.join(".cache", "batch_autotune.json")
+DEVICE_HEADROOM = 0.85  # 顯示卡：峰值最多用到總容量的 85% (試跑沒算到的 autocast、optimizer state 與碎片化要留空間)
+HOST_HEADROOM = 0.70    # CPU：最多用掉目前可用記憶體的 70% (dataloader、OS 也要用)
+SAMPLE_INTERVAL = 0.005
+
+def candidate_batch_sizes(effective_batch):
+    """能整除有效 batch 的 batch size，由小到大"""
+    return [b for b in range(1, effective_batch + 1) if effective_batch % b == 0]
+
+def current_rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1 << 20)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def available_host_mb():
+    try:
+        import psutil
+        return psutil.virtual_memory().available / (1 << 20)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def hardware_fingerprint(device):
+    fp = {"torch": torch.__version__, "machine": platform.machine(), "device": device.type}
+    if device.type == "cuda":
+        props = torch.cuda.get_device_properties(device)
+        fp.update({"gpu": props.name, "gpu_total_mb": props.total_memory >> 20})
+    else:
+        fp.update({"cpu": platform.processor() or platform.platform(), "threads": torch.get_num_threads()})
+        if hasattr(os, "sysconf") and "SC_PHYS_PAGES" in os.sysconf_names:
+            fp["host_total_mb"] = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") >> 20
+    return fp
+
+class RssSampler:
+    """背景執行緒每 5ms 取樣一次 RSS，記下這段期間的峰值"""
+    def __init__(self):
+        self.peak = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+def is_oom(e):
+    if isinstance(e, torch.cuda.OutOfMemoryError):
+        return True
+    msg = str(e).lower()
+    return isinstance(e, RuntimeError) and ("out of memory" in msg or "can't allocate memory" in msg)
+
+def release_memory(model, device):
+    model.zero_grad(set_to_none=True)
+    gc.collect()
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+
+def probe_step(model, loss_fn, inputs, device):
+    """跑一次 forward + backward，回傳 (峰值記憶體 MB, 秒數)"""
+    start = time.perf_counter()
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+        loss_fn(model, inputs).backward()
+        torch.cuda.synchronize(device)
+        peak = torch.cuda.max_memory_allocated(device) / (1 << 20)
+    else:
+        with RssSampler() as sampler:
+            loss_fn(model, inputs).backward()
+        peak = sampler.peak
+    return peak, time.perf_counter() - start
+
+def memory_limit_mb(device):
+    if device.type == "cuda":
+        return torch.cuda.get_device_properties(device).total_memory / (1 << 20) * DEVICE_HEADROOM
+    rss, available = current_rss_mb(), available_host_mb()
+    if rss is None or available is None:
+        return None
+    return rss + available * HOST_HEADROOM
+
+def load_cache():
+    if not os.path.exists(AUTOTUNE_CACHE):
+        return {}
+    try:
+        with open(AUTOTUNE_CACHE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache):
+    os.makedirs(os.path.dirname(AUTOTUNE_CACHE), exist_ok=True)
+    tmp_path = AUTOTUNE_CACHE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, AUTOTUNE_CACHE)
+
+def autotune_batch_size(model, loss_fn, make_batch, effective_batch, fingerprint, default_batch_size):
+    """
+    回傳 (batch_size, grad_accum)，batch_size × grad_accum == effective_batch
+    loss_fn(model, inputs) -> 純量 loss；make_batch(b) -> 最壞情況 (最長 b 筆) 的 batch
+    fingerprint: 模型 / 序列長度等會影響記憶體的設定，會再加上硬體指紋當快取 key
+    """
+    device = next(model.parameters()).device
+    fp = {**fingerprint, **hardware_fingerprint(device), "effective_batch": effective_batch}
+    key = hashlib.sha256(json.dumps(fp, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    cache = load_cache()
+    if key in cache:
+        batch_size = cache[key]["batch_size"]
+        print(f"⚡ 命中 batch 自動調整快取: batch {batch_size} × 累積 {effective_batch // batch_size}")
+        return batch_size, effective_batch // batch_size
+
+    limit = memory_limit_mb(device)
+    if limit is None:
+        print(f"⚠️ 無法量測記憶體 (CPU 上需要 psutil 或 /proc)，沿用 batch {default_batch_size}")
+        return default_batch_size, effective_batch // default_batch_size
+
+    print(f"🔧 自動調整 batch size (有效 batch {effective_batch}，記憶體上限 {limit:.0f} MB)...")
+    was_training = model.training
+    model.train()
+    release_memory(model, device)
+    base = torch.cuda.memory_allocated(device) / (1 << 20) if device.type == "cuda" else current_rss_mb()
+    best, probes = None, []
+    for b in candidate_batch_sizes(effective_batch):
+        if probes:
+            # 依上一次的增量線性外推，預估會超過上限就不冒險
+            last_b, last_peak = probes[-1]["batch_size"], probes[-1]["peak_mb"]
+            predicted = base + (last_peak - base) * b / last_b
+            if predicted > limit:
+                print(f"   batch {b:>3}: 預估 {predicted:.0f} MB > 上限，停止")
+                break
+        try:
+            inputs = make_batch(b)
+            peak, seconds = probe_step(model, loss_fn, inputs, device)
+        except Exception as e:
+            if not is_oom(e):
+                raise
+            print(f"   batch {b:>3}: OOM，停止")
+            break
+        finally:
+            inputs = None
+            release_memory(model, device)
+        probes.append({"batch_size": b, "peak_mb": round(peak, 1), "seconds": round(seconds, 3)})
+        print(f"   batch {b:>3}: 峰值 {peak:.0f} MB，{seconds:.2f} 秒")
+        if peak > limit:
+            print(f"   batch {b:>3}: 超過上限，停止")
+            break
+        best = b
+    model.train(was_training)
+
+    if best is None:
+        print("⚠️ 連 batch 1 都超過記憶體上限，用 batch 1 試試看")
+        best = 1
+    cache[key] = {"batch_size": best, "fingerprint": fp, "probes": probes,
+                  "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+    try:
+        save_cache(cache)
+    except OSError as e:
+        print(f"⚠️ 無法寫入 batch 自動調整快取: {e}")
+    print(f"✅ 選定 batch {best} × 累積 {effective_batch // best}")
+    return best, effective_batch // best
@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+
+from .hook import TIMINGS, BootstrapFinder
+from . import shims, inductor, unsloth_patch
+
+# =================================================================
+# 🛡️ Windows 防禦系統 (共用版)
+# 04_train.py / 06_test_multilingual.py 共用的啟動修補，原本兩邊各複製一份、一開頭就全部執行
+# 現在 install() 只掛上一個 sys.meta_path hook，真的有人 import 到才套用：
+#   1. AMP Polyfills (torch.amp.custom_fwd 等)  -> torch 載入完成後
+#   2. 閹割 torch.compile                        -> torch 載入完成後               } 預設 (推論) 一律套用；
+#   3. 偽造 torch._inductor                      -> 有人 import torch._inductor.* 時 } 訓練用 "auto" 時只在 inductor 檢測失敗才套用 (見 inductor.py)
+#   4. 偽造 torchvision                          -> 有人 import torchvision 時
+#   5. Unsloth 原始碼修補 (取代 00_fix_unsloth.py) -> 有人 import unsloth 時 (見 unsloth_patch.py)
+# 用法：在 import torch 之前
+#   import runtime_bootstrap
+#   runtime_bootstrap.install()                      # 推論：torch.compile 一律 eager
+#   runtime_bootstrap.install(torch_compile="auto")  # 訓練：torch 載入後檢測 inductor，能用就保留
+#   ... (其他 import)
+#   runtime_bootstrap.report()  # 印出啟動耗時與每個 shim 花的時間
+# 想知道剩下的時間花在哪：python -m runtime_bootstrap.profile
+# =================================================================
+
+_finder = None
+_installed_at = None
+_compile_status = None
+
+def install(torch_compile=False):
+    """torch_compile: False = 一律 eager (預設)；"auto" = torch 載入後檢測 inductor；True = 強制開"""
+    global _finder, _installed_at, _compile_status
+    if _finder is not None:
+        return _finder
+    _installed_at = time.perf_counter()
+
+    # 關閉 Unsloth 自己的模型編譯 (要在 import unsloth 之前設定)
+    os.environ["UNSLOTH_COMPILE_DISABLE"] = "1"
+    os.environ["UNSLOTH_NO_model_card"] = "1"
+
+    finder = BootstrapFinder()
+    if "torchvision" not in sys.modules:
+        for name in shims.TORCHVISION_MODULES:
+            finder.add_fake(name, shims.make_fake_torchvision)
+    sys.meta_path.insert(0, finder)
+
+    finder.add_post_import("torch", "torch.amp", _safe(shims.patch_amp, "AMP Patch"))
+    if torch_compile == "auto":
+        # 子行程檢測只在 torch 真的被 import 時才跑 (快取命中時只讀一個 json)
+        inductor.enable_compile_cache()
+        finder.add_post_import("torch", "inductor 檢測", lambda torch: _probe_compile(finder, torch))
+    elif torch_compile:
+        inductor.enable_compile_cache()
+        _compile_status = (True, "手動指定")
+    else:
+        _use_eager(finder)
+        _compile_status = (False, "預設 eager")
+    unsloth_patch.install(finder)
+    _finder = finder
+    return finder
+
+def _use_eager(finder):
+    for name in shims.INDUCTOR_MODULES:
+        if name not in sys.modules:
+            finder.add_fake(name, shims.make_fake_inductor)
+    finder.add_post_import("torch", "torch.compile", shims.patch_compile)
+
+def _probe_compile(finder, torch):
+    global _compile_status
+    compile_ok, reason = inductor.probe_inductor(torch)
+    _compile_status = (compile_ok, reason)
+    if not compile_ok:
+        _use_eager(finder)
+
+def _safe(func, label):
+    def wrapper(module):
+        try:
+            func(module)
+        except Exception as e:
+            print(f"⚠️ {label} Warning: {e}")
+    return wrapper
+
+def report():
+    """印出 install() 到現在的啟動耗時，以及每個 shim 實際花的時間"""
+    if _installed_at is None:
+        return
+    total = time.perf_counter() - _installed_at
+    shim_total = sum(seconds for _, seconds in TIMINGS)
+    print(f"⏱️ 啟動耗時 {total:.2f} 秒 (其中修補 {shim_total * 1000:.1f} ms，共 {len(TIMINGS)} 個 shim)")
+    if _compile_status is not None:
+        compile_ok, reason = _compile_status
+        print(f"   torch.compile: {'✅ 啟用 (編譯快取開啟)' if compile_ok else '❌ 停用 (eager)'} - {reason}")
+    for label, seconds in TIMINGS:
+        print(f"   - {label}: {seconds * 1000:.2f} ms")
@@ -0,0 +1,110 @@
+import sys
+import time
+
+# =================================================================
+# sys.meta_path import hook：
+# - 偽造模組 (torch._inductor.*、torchvision)：有人 import 時才建立並回傳
+# - 修補既有模組 (torch.amp、torch.compile)：真的 torch 載入完成後才套用
+# - 改寫原始碼 (unsloth 的幾個檔案)：換成會在記憶體裡修補原始碼的 loader
+# 每個 shim 花的時間都記在 TIMINGS，給 runtime_bootstrap.report() 用
+# =================================================================
+
+TIMINGS = []  # [(shim 名稱, 秒數)]
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        TIMINGS.append((label, time.perf_counter() - start))
+
+class _FakeLoader:
+    def __init__(self, factory):
+        self.factory = factory
+
+    def create_module(self, spec):
+        return timed(spec.name, self.factory, spec.name)
+
+    def exec_module(self, module):
+        pass
+
+class _PostImportLoader:
+    """包住真正的 loader，模組執行完之後跑 hooks，再把 loader 換回原本的"""
+
+    def __init__(self, loader, hooks):
+        self.loader = loader
+        self.hooks = hooks
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.loader.exec_module(module)
+        module.__loader__ = self.loader
+        if getattr(module, "__spec__", None) is not None:
+            module.__spec__.loader = self.loader
+        for label, hook in self.hooks:
+            timed(label, hook, module)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+class BootstrapFinder:
+    def __init__(self):
+        self.fakes = {}       # 模組名稱 -> 建立偽造模組的 factory
+        self.post_hooks = {}  # 模組名稱 -> [(shim 名稱, hook(module))]
+        self.transforms = {}  # 模組名稱 -> make_loader(fullname, path)
+        self._resolving = set()
+
+    def add_fake(self, name, factory):
+        self.fakes[name] = factory
+
+    def add_post_import(self, name, label, hook):
+        if name in sys.modules:
+            # 已經 import 過了 (例如 bootstrap 之前就 import torch)，直接套用
+            timed(label, hook, sys.modules[name])
+            return
+        self.post_hooks.setdefault(name, []).append((label, hook))
+
+    def add_source_transform(self, name, make_loader):
+        self.transforms[name] = make_loader
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname in self.fakes:
+            from .shims import fake_spec
+            return fake_spec(fullname, _FakeLoader(self.fakes[fullname]))
+
+        make_loader = self.transforms.get(fullname)
+        if make_loader is not None:
+            spec = self._find_real_spec(fullname, path, target)
+            # 只處理一般的 .py 原始檔，其他情況 (沒找到、.pyc-only 安裝) 照原本方式載入
+            if spec is None or not (spec.origin or "").endswith(".py"):
+                return spec
+            spec.loader = make_loader(fullname, spec.origin)
+            return spec
+
+        hooks = self.post_hooks.get(fullname)
+        if not hooks:
+            return None
+        spec = self._find_real_spec(fullname, path, target)
+        if spec is None or spec.loader is None:
+            return spec
+        del self.post_hooks[fullname]
+        spec.loader = _PostImportLoader(spec.loader, hooks)
+        return spec
+
+    def _find_real_spec(self, fullname, path, target):
+        """請後面的 finder 找出真正的模組"""
+        if fullname in self._resolving:
+            return None
+        self._resolving.add(fullname)
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    return spec
+            return None
+        finally:
+            self._resolving.discard(fullname)
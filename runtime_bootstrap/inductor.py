@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import platform
+import subprocess
+import importlib.metadata
+
+# =================================================================
+# torch.compile 能力檢測
+# 以前不管哪台機器都直接閹割 torch.compile、偽造 torch._inductor，
+# 結果 unsloth_compiled_cache/*Trainer.py 裡 @torch.compile 的 kernel
+# (chunked_selective_log_softmax 等) 永遠只能跑 eager。
+# 訓練腳本用 install(torch_compile="auto")：torch 載入之後 (import torch 不會載入 torch._inductor)，
+# 在子行程裡用「訓練真的會用的裝置」編譯一個小函式 (CUDA 還要先能 import triton)：
+#   - 成功 -> 保留 torch.compile，並開啟硬碟上的編譯快取，下次不用重新編譯
+#   - 失敗 / 當掉 / 超時 (例如 Windows 沒有 C++ 編譯器或 Triton) -> 跟以前一樣全部換成 shim
+# 推論 (06) 用預設的 install()，一律 eager，不做檢測。
+# 檢測結果依 torch / CUDA / Triton 版本與 GPU 型號快取在 .cache/inductor_probe.json；
+# 之後裝了編譯器或 Triton，用 python 04_benchmark_compile.py --force 重新檢測
+# =================================================================
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBE_CACHE = os.path.join(ROOT, ".cache", "inductor_probe.json")
+COMPILE_CACHE_DIR = os.path.join(ROOT, ".cache", "torchinductor")
+PROBE_TIMEOUT = 300  # 秒；inductor 第一次要編 C++，慢的機器要等一陣子 (只有快取沒命中時才會跑)
+TRITON_PACKAGES = ["triton", "triton-windows", "pytorch-triton"]
+
+# 子行程裡跑的檢測程式：在指定裝置上編譯一個跟 chunked_selective_log_softmax 同類型的函式，並比對 eager 結果
+PROBE_CODE = """
+import sys
+import torch
+device = sys.argv[1]
+if device == "cuda":
+    import triton  # CUDA 上的 inductor kernel 都是 Triton 產生的
+def f(logits, index):
+    logits = logits.to(torch.float32)
+    selected = torch.gather(logits, dim = -1, index = index.unsqueeze(-1)).squeeze(-1)
+    return selected - torch.logsumexp(logits, dim = -1)
+logits = torch.randn(8, 64, device = device)
+index = torch.randint(0, 64, (8,), device = device)
+compiled = torch.compile(f, backend = "inductor", dynamic = True, fullgraph = True)
+assert torch.allclose(compiled(logits, index), f(logits, index), atol = 1e-5)
+print("INDUCTOR_OK")
+"""
+
+def enable_compile_cache():
+    """開啟 inductor 的硬碟快取 (FX graph / AOTAutograd)；要在 torch._inductor 載入之前呼叫才有效"""
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_CACHE_DIR)
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    os.environ.setdefault("TORCHINDUCTOR_AUTOGRAD_CACHE", "1")
+
+def triton_version():
+    for name in TRITON_PACKAGES:
+        try:
+            return f"{name} {importlib.metadata.version(name)}"
+        except importlib.metadata.PackageNotFoundError:
+            pass
+    return None
+
+def probe_device(torch):
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def fingerprint(torch):
+    """只放真的會影響 inductor 能不能用的東西；OS 小更新、PATH 變動不會讓快取失效"""
+    device = probe_device(torch)
+    return {
+        "torch": torch.__version__,
+        "cuda": torch.version.cuda,
+        "device": torch.cuda.get_device_name(0) if device == "cuda" else "cpu",
+        "triton": triton_version() if device == "cuda" else None,
+        "python": f"{sys.version_info[0]}.{sys.version_info[1]}",
+        "system": platform.system(),
+        "machine": platform.machine(),
+    }
+
+def _run_probe(device):
+    env = dict(os.environ)
+    env.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_CACHE_DIR)
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-c", PROBE_CODE, device], env=env, timeout=PROBE_TIMEOUT,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        )
+    except subprocess.TimeoutExpired:
+        return False, f"檢測超過 {PROBE_TIMEOUT} 秒"
+    except OSError as e:
+        return False, f"無法啟動檢測: {e}"
+    if proc.returncode == 0 and "INDUCTOR_OK" in proc.stdout:
+        return True, f"inductor 編譯成功 ({device})"
+    # 優先回報最後一個例外訊息 (torch 會在後面附上一堆 debug 提示)
+    lines = [line.strip() for line in proc.stderr.splitlines() if line.strip()]
+    errors = [line for line in lines if "Error" in line or "Exception" in line] or lines
+    return False, errors[-1][:200] if errors else f"檢測失敗 (exit code {proc.returncode})"
+
+def probe_inductor(torch, force=False):
+    """回傳 (inductor 是否可用, 原因)；torch 是已經載入的 torch 模組，結果依環境指紋快取"""
+    fp = fingerprint(torch)
+    if not force and os.path.exists(PROBE_CACHE):
+        try:
+            with open(PROBE_CACHE, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("fingerprint") == fp:
+                return cached["ok"], cached["reason"] + " (快取)"
+        except (OSError, ValueError, KeyError):
+            pass
+
+    ok, reason = _run_probe(probe_device(torch))
+    try:
+        os.makedirs(os.path.dirname(PROBE_CACHE), exist_ok=True)
+        with open(PROBE_CACHE, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fp, "ok": ok, "reason": reason}, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f"⚠️ 無法寫入 inductor 檢測快取: {e}")
+    return ok, reason
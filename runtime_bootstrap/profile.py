@@ -0,0 +1,63 @@
+import os
+import re
+import sys
+import subprocess
+
+# =================================================================
+# import 耗時分析：用 python -X importtime 在子行程裡 import 一次，列出最花時間的模組
+# 用法: python -m runtime_bootstrap.profile [模組 ...]
+#       (預設是 04_train.py / 06_test_multilingual.py 開頭會 import 的那些)
+# =================================================================
+
+DEFAULT_MODULES = ["torch", "transformers", "datasets", "peft", "trl", "unsloth"]
+TOP_N = 15
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+def parse_importtime(stderr):
+    """回傳 [(模組, self 秒數, cumulative 秒數, 層級)]"""
+    rows = []
+    for line in stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m:
+            self_us, cumulative_us, indent, name = m.groups()
+            rows.append((name, int(self_us) / 1e6, int(cumulative_us) / 1e6, (len(indent) - 1) // 2))
+    return rows
+
+def profile_imports(modules):
+    code = "import runtime_bootstrap; runtime_bootstrap.install()\n"
+    for name in modules:
+        # 沒安裝的套件跳過 (例如 CPU 機器上的 unsloth)
+        code += f"try:\n    import {name}\nexcept Exception as e:\n    print('SKIP {name}:', e)\n"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    skipped = [line for line in proc.stdout.splitlines() if line.startswith("SKIP ")]
+    return parse_importtime(proc.stderr), skipped
+
+def main():
+    modules = sys.argv[1:] or DEFAULT_MODULES
+    print(f"🔬 分析 import 耗時: {', '.join(modules)}")
+    rows, skipped = profile_imports(modules)
+    for line in skipped:
+        print(f"   ⚠️ {line[5:]}")
+    if not rows:
+        print("❌ 沒有拿到 importtime 輸出")
+        return
+
+    top_level = [r for r in rows if r[3] == 0]
+    total = sum(r[2] for r in top_level)
+    print(f"\n⏱️ import 總耗時: {total:.2f} 秒 ({len(rows)} 個模組)")
+
+    print(f"\n📦 最花時間的頂層 import (含子模組):")
+    for name, _, cumulative, _ in sorted(top_level, key=lambda r: -r[2])[:TOP_N]:
+        print(f"   {cumulative:8.3f} 秒  {cumulative / total:6.1%}  {name}")
+
+    print(f"\n🐢 模組本身最慢的 (不含子模組):")
+    for name, self_time, _, _ in sorted(rows, key=lambda r: -r[1])[:TOP_N]:
+        print(f"   {self_time:8.3f} 秒  {name}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import types
+import importlib
+import importlib.machinery
+
+# =================================================================
+# 各個 shim 本體 (原本 04_train.py / 06_test_multilingual.py 開頭那一大段)
+# 這裡只定義，不會自己執行；由 hook.py 在真的有人 import 到的時候才套用
+# =================================================================
+
+# 偽造的 torch._inductor 子模組 (unsloth 會 import 這幾個，Windows 上真的 inductor 用不了)
+INDUCTOR_MODULES = [
+    "torch._inductor", "torch._inductor.config",
+    "torch._inductor.runtime", "torch._inductor.runtime.hints",
+    "torch._inductor.test_operators", "torch._inductor.utils",
+]
+TORCHVISION_MODULES = ["torchvision", "torchvision.ops"]
+FAKE_PACKAGES = {"torch._inductor", "torch._inductor.runtime", "torchvision"}
+FAKE_TORCHVISION_VERSION = "0.19.1"
+
+def patch_amp(torch):
+    """🔥 智慧轉接頭 V3 (AMP Polyfills)：舊版 torch 沒有 torch.amp.custom_fwd / is_autocast_available"""
+    if not hasattr(torch.amp, "custom_fwd"):
+        from torch.cuda.amp import custom_fwd as legacy_fwd
+        from torch.cuda.amp import custom_bwd as legacy_bwd
+
+        def smart_custom_fwd(*args, **kwargs):
+            if "device_type" in kwargs or len(args) == 0:
+                def decorator(func): return legacy_fwd(func)
+                return decorator
+            return legacy_fwd(*args, **kwargs)
+
+        def smart_custom_bwd(*args, **kwargs):
+            if "device_type" in kwargs or len(args) == 0:
+                def decorator(func): return legacy_bwd(func)
+                return decorator
+            return legacy_bwd(*args, **kwargs)
+
+        torch.amp.custom_fwd = smart_custom_fwd
+        torch.amp.custom_bwd = smart_custom_bwd
+
+    if not hasattr(torch.amp, "is_autocast_available"):
+        def mock_is_autocast_available(device_type):
+            return device_type == "cuda"
+        torch.amp.is_autocast_available = mock_is_autocast_available
+
+def dummy_compile(model=None, *, fullgraph=False, dynamic=False, backend="inductor", mode=None, options=None, disable=False):
+    def decorator(func): return func
+    if model and callable(model): return model
+    return decorator
+
+def patch_compile(torch):
+    """閹割 torch.compile"""
+    torch.compile = dummy_compile
+
+class MockDeviceProperties:
+    def __init__(self, *args, **kwargs): pass
+
+def _lazy_submodules(m, names):
+    # 原本是把子模組直接掛在父模組上；現在改成第一次存取 torchvision.ops 這類屬性時才 import
+    children = {n.rpartition(".")[2] for n in names if n.rpartition(".")[0] == m.__name__}
+
+    def __getattr__(attr):
+        if attr in children:
+            return importlib.import_module(f"{m.__name__}.{attr}")
+        raise AttributeError(f"module {m.__name__!r} has no attribute {attr!r}")
+    m.__getattr__ = __getattr__
+
+def make_fake_inductor(name):
+    m = types.ModuleType(name)
+    if name in FAKE_PACKAGES: _lazy_submodules(m, INDUCTOR_MODULES)
+    if name == "torch._inductor.config": m.is_fbcode = lambda: False
+    if name == "torch._inductor.runtime.hints": m.DeviceProperties = MockDeviceProperties
+    return m
+
+def make_fake_torchvision(name):
+    m = types.ModuleType(name)
+    if name == "torchvision":
+        m.__version__ = FAKE_TORCHVISION_VERSION
+        _lazy_submodules(m, TORCHVISION_MODULES)
+    else:
+        m.nms = lambda *args, **kwargs: args[0]
+    return m
+
+def fake_spec(name, loader):
+    # package 的 __path__ 是空的，子模組一樣只會由 hook 提供
+    return importlib.machinery.ModuleSpec(name=name, loader=loader, is_package=name in FAKE_PACKAGES)
@@ -0,0 +1,146 @@
+import os
+import re
+import sys
+import types
+import marshal
+import hashlib
+import importlib.machinery
+import importlib.metadata
+
+from .hook import timed
+
+# =================================================================
+# Unsloth 修補 (原本 00_fix_unsloth.py 直接改寫 site-packages 裡的檔案)
+# 現在改成 import 時在記憶體裡改原始碼：
+# - 不動安裝目錄，重裝 Unsloth 也不會失效，Linux / Windows 都能用
+# - 改好的 bytecode 用 marshal 存進 .cache/unsloth_patched/，
+#   key = Unsloth 版本 + 這個檔案 (修補內容) 的 hash + 原始檔大小與修改時間，
+#   第一次之後直接載入 bytecode，跟沒修補的 import 一樣快
+# - Qwen 3 相關模組完全不會被 import，直接給空殼
+# =================================================================
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "unsloth_patched")
+
+ROBUST_MOCK = "class CompileConfig:\n    def __init__(self, *args, **kwargs): pass\n"
+
+def patch_vision(content):
+    """任務 A: 修復 vision.py (CompileConfig)"""
+    if "class CompileConfig: pass" in content:
+        return content.replace("class CompileConfig: pass", ROBUST_MOCK)
+    if ", CompileConfig" in content:
+        content = content.replace(", CompileConfig", "")
+        if "from transformers import GenerationConfig" in content:
+            content = content.replace("from transformers import GenerationConfig", f"{ROBUST_MOCK}\nfrom transformers import GenerationConfig")
+    return content
+
+def patch_import_fixes(content):
+    """任務 B: 修復 import_fixes.py (Torchvision)"""
+    if 'importlib.util.find_spec("torchvision")' not in content:
+        return content
+    new_lines = []
+    skip = False
+    for line in content.splitlines():
+        if "def torchvision_compatibility_check():" in line:
+            new_lines.append("def torchvision_compatibility_check(): pass")
+            skip = True
+        elif skip and line.strip().startswith("def "):
+            skip = False
+            new_lines.append(line)
+        elif not skip:
+            new_lines.append(line)
+    return "\n".join(new_lines)
+
+def patch_loader(content):
+    """任務 C: 修復 loader.py (停用 Qwen 3 載入)"""
+    # 只改還沒被註解掉的那行，舊版 00_fix_unsloth.py 改過的檔案再套一次也不會重複
+    for module, cls in (("qwen3", "FastQwen3Model"), ("qwen3_moe", "FastQwen3MoeModel")):
+        content = re.sub(
+            rf"^([ \t]*)from \.{module} import {cls}\b",
+            rf"\1class {cls}: pass # Disabled\n\1# from .{module} import {cls}",
+            content, flags=re.M,
+        )
+    return content
+
+def patch_models_init(content):
+    """任務 E: 封殺 models/__init__.py (防止自動匯入 Qwen 3)"""
+    lines = content.splitlines(keepends=True)
+    return "".join(f"# {line}" if line.lstrip().startswith("from .qwen3") else line for line in lines)
+
+TRANSFORMS = {
+    "unsloth.models.vision": patch_vision,
+    "unsloth.import_fixes": patch_import_fixes,
+    "unsloth.models.loader": patch_loader,
+    "unsloth.models": patch_models_init,
+}
+
+# 任務 D: Qwen 3 模組只給空殼
+STUB_MODULES = ["unsloth.models.qwen3", "unsloth.models.qwen3_moe"]
+
+def make_qwen3_stub(name):
+    m = types.ModuleType(name)
+    m.FastQwen3Model = type("FastQwen3Model", (), {})
+    m.FastQwen3MoeModel = type("FastQwen3MoeModel", (), {})
+    return m
+
+def patch_set_hash():
+    with open(os.path.abspath(__file__), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+def unsloth_version():
+    try:
+        return importlib.metadata.version("unsloth")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+def cache_key_prefix():
+    # marshal 格式跟 Python 版本綁在一起，所以也放進 key
+    return f"{unsloth_version()}|{patch_set_hash()}|{sys.version_info[0]}.{sys.version_info[1]}"
+
+class PatchedSourceLoader(importlib.machinery.SourceFileLoader):
+    """跟一般 .py 的 loader 一樣，只是 get_code 回傳修補過 (並快取) 的 bytecode"""
+
+    def __init__(self, fullname, path, transform, key_prefix):
+        super().__init__(fullname, path)
+        self.transform = transform
+        self.key_prefix = key_prefix
+
+    def cache_path(self):
+        st = os.stat(self.path)
+        key = hashlib.sha256(f"{self.key_prefix}|{self.path}|{st.st_size}|{st.st_mtime_ns}".encode("utf-8")).hexdigest()[:16]
+        return os.path.join(CACHE_DIR, f"{self.name}.{key}.bin")
+
+    def get_code(self, fullname):
+        cache_path = self.cache_path()
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    return timed(f"{fullname} (bytecode 快取)", marshal.load, f)
+            except Exception:
+                pass  # 快取壞掉就重新編譯
+        return timed(f"{fullname} (修補 + 編譯)", self._compile_patched, cache_path)
+
+    def _compile_patched(self, cache_path):
+        source = self.get_data(self.path).decode("utf-8")
+        code = compile(self.transform(source), self.path, "exec", dont_inherit=True)
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                marshal.dump(code, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"⚠️ 無法寫入 Unsloth 修補快取: {e}")
+        return code
+
+def install(finder):
+    """把 Unsloth 修補掛到 BootstrapFinder 上 (runtime_bootstrap.install() 會呼叫)"""
+    if "unsloth" in sys.modules:
+        print("⚠️ unsloth 已經被 import，修補來不及套用")
+        return
+    key_prefix = cache_key_prefix()
+    for name, transform in TRANSFORMS.items():
+        finder.add_source_transform(
+            name, lambda fullname, path, t=transform: PatchedSourceLoader(fullname, path, t, key_prefix)
+        )
+    for name in STUB_MODULES:
+        finder.add_fake(name, make_qwen3_stub)
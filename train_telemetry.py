@@ -0,0 +1,203 @@
+import os
+import sys
+import csv
+import json
+import time
+import statistics
+import torch
+from transformers import TrainerCallback
+
+# =================================================================
+# 📈 訓練遙測 (04_train.py)
+# 每個 optimizer step 記一筆：
+#   - token/s (真實 token 與 padding 分開算)、samples/s
+#   - 等 dataloader 的時間 vs forward/backward 的時間 vs optimizer.step 的時間
+#   - 峰值 RSS、裝置記憶體 (CUDA 才有)
+# 逐步寫進 <output_dir>/telemetry/<run>.jsonl，訓練結束再輸出 CSV 與摘要 (.summary.json + 印出表格)
+# 想比較 batch size / pack / dataloader workers 的效果，看摘要裡的 tokens/s 與 data wait 就好
+#
+# Trainer 的 callback 看不到 batch 內容，所以 dataloader 的部分要由 Trainer 回報：
+#   UruhaSFTTrainer.get_batch_samples() -> telemetry.on_batches_fetched(batches, 秒數)
+# =================================================================
+
+SUMMARY_FIELDS = [
+    ("step_time", "每步總耗時 (s)"),
+    ("data_wait", "等 dataloader (s)"),
+    ("compute_time", "forward+backward (s)"),
+    ("optimizer_time", "optimizer.step (s)"),
+    ("tokens_per_sec", "tokens/s (真實)"),
+    ("pad_tokens_per_sec", "tokens/s (padding)"),
+    ("samples_per_sec", "samples/s"),
+]
+
+def peak_rss_mb():
+    """目前為止的峰值 RSS (MB)；Windows 沒有 resource 模組，改用 psutil (有裝的話)"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 單位是 KB，macOS 是 bytes
+        return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1 << 20)
+    except ImportError:
+        return None
+
+def count_batch(inputs):
+    """回傳 (真實 token 數, padding token 數, 樣本數)"""
+    input_ids = inputs["input_ids"]
+    if "attention_mask" in inputs:
+        real = int(inputs["attention_mask"].sum())
+        samples = input_ids.shape[0]
+    else:
+        # pack 模式沒有 padding：每個 position_ids == 0 的位置是一筆樣本的開頭
+        real = input_ids.numel()
+        position_ids = inputs.get("position_ids")
+        samples = int((position_ids == 0).sum()) if position_ids is not None else input_ids.shape[0]
+    return real, input_ids.numel() - real, samples
+
+class TelemetryCallback(TrainerCallback):
+    def __init__(self, output_dir="outputs", run_name=None, warmup_steps=2):
+        self.log_dir = os.path.join(output_dir, "telemetry")
+        self.run_name = run_name or time.strftime("%Y%m%d-%H%M%S")
+        self.warmup_steps = warmup_steps  # 前幾步含編譯 / 配置記憶體，不算進摘要
+        self.rows = []
+        self.extra = {}  # 額外寫進摘要的設定 (batch size、批次組法...)
+        self._log_file = None
+        self._reset_step()
+
+    @property
+    def jsonl_path(self):
+        return os.path.join(self.log_dir, f"{self.run_name}.jsonl")
+
+    def _reset_step(self):
+        self._fetch_start = None
+        self._data_wait = 0.0
+        self._tokens = self._pad_tokens = self._samples = 0
+        self._compute_start = self._optimizer_start = None
+        self._compute_time = self._optimizer_time = 0.0
+
+    def _sync(self):
+        # CUDA 是非同步的，不同步的話時間會全部算到下一個會等 GPU 的地方
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    def on_batches_fetched(self, batches, seconds):
+        """由 Trainer 在拿到這一步的 (gradient accumulation 份) batch 之後呼叫"""
+        self._fetch_start = time.perf_counter() - seconds
+        self._data_wait += seconds
+        for inputs in batches:
+            real, pad, samples = count_batch(inputs)
+            self._tokens += real
+            self._pad_tokens += pad
+            self._samples += samples
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._log_file = open(self.jsonl_path, "a", encoding="utf-8")
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        self._compute_start = time.perf_counter()
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._sync()
+        now = time.perf_counter()
+        if self._compute_start is not None:
+            self._compute_time = now - self._compute_start
+        self._optimizer_start = now
+
+    def on_optimizer_step(self, args, state, control, **kwargs):
+        self._sync()
+        if self._optimizer_start is not None:
+            self._optimizer_time = time.perf_counter() - self._optimizer_start
+
+    def on_step_end(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        start = self._fetch_start if self._fetch_start is not None else self._compute_start
+        step_time = max(now - start, 1e-9) if start is not None else None
+        row = {
+            "step": state.global_step,
+            "epoch": round(state.epoch or 0.0, 4),
+            "step_time": step_time,
+            "data_wait": self._data_wait,
+            "compute_time": self._compute_time,
+            "optimizer_time": self._optimizer_time,
+            "tokens": self._tokens,
+            "pad_tokens": self._pad_tokens,
+            "samples": self._samples,
+            "tokens_per_sec": self._tokens / step_time if step_time else None,
+            "pad_tokens_per_sec": self._pad_tokens / step_time if step_time else None,
+            "samples_per_sec": self._samples / step_time if step_time else None,
+            "peak_rss_mb": peak_rss_mb(),
+            "device_peak_mb": torch.cuda.max_memory_allocated() / (1 << 20) if torch.cuda.is_available() else None,
+        }
+        self.rows.append(row)
+        if self._log_file is not None:
+            self._log_file.write(json.dumps(row) + "\n")
+            self._log_file.flush()
+        self._reset_step()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+        if not self.rows:
+            return
+        self.write_csv()
+        summary = self.summary()
+        with open(os.path.join(self.log_dir, f"{self.run_name}.summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        self.print_summary(summary)
+
+    def write_csv(self):
+        with open(os.path.join(self.log_dir, f"{self.run_name}.csv"), "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(self.rows[0]))
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def summary(self):
+        rows = self.rows[self.warmup_steps:] or self.rows
+        total_time = sum(r["step_time"] for r in rows)
+        total_tokens = sum(r["tokens"] for r in rows)
+        total_pad = sum(r["pad_tokens"] for r in rows)
+        summary = {
+            "run": self.run_name,
+            "steps": len(rows),
+            "skipped_warmup_steps": len(self.rows) - len(rows),
+            **self.extra,
+            # 整體平均用總量相除，不被個別很慢 / 很快的步拉偏
+            "tokens_per_sec": total_tokens / total_time,
+            "pad_tokens_per_sec": total_pad / total_time,
+            "samples_per_sec": sum(r["samples"] for r in rows) / total_time,
+            "padding_ratio": total_pad / max(total_tokens + total_pad, 1),
+            "data_wait_ratio": sum(r["data_wait"] for r in rows) / total_time,
+            "compute_ratio": sum(r["compute_time"] for r in rows) / total_time,
+            "optimizer_ratio": sum(r["optimizer_time"] for r in rows) / total_time,
+            "peak_rss_mb": max((r["peak_rss_mb"] or 0) for r in self.rows) or None,
+            "device_peak_mb": max((r["device_peak_mb"] or 0) for r in self.rows) or None,
+        }
+        for key, _ in SUMMARY_FIELDS:
+            values = sorted(r[key] for r in rows)
+            summary[f"{key}_p50"] = statistics.median(values)
+            summary[f"{key}_p95"] = values[min(len(values) - 1, int(len(values) * 0.95))]
+        return summary
+
+    def print_summary(self, summary):
+        print(f"📈 訓練遙測摘要 ({summary['steps']} 步，略過前 {summary['skipped_warmup_steps']} 步暖機)")
+        print(f"   {'指標':<22} {'p50':>12} {'p95':>12}")
+        for key, label in SUMMARY_FIELDS:
+            print(f"   {label:<22} {summary[f'{key}_p50']:>12.3f} {summary[f'{key}_p95']:>12.3f}")
+        print(f"   整體: {summary['tokens_per_sec']:.1f} tokens/s (padding 另有 {summary['pad_tokens_per_sec']:.1f}/s，"
+              f"佔 {summary['padding_ratio']:.1%}) | {summary['samples_per_sec']:.2f} samples/s")
+        print(f"   時間分配: data wait {summary['data_wait_ratio']:.1%} | forward+backward {summary['compute_ratio']:.1%} | "
+              f"optimizer {summary['optimizer_ratio']:.1%}")
+        if summary["peak_rss_mb"]:
+            print(f"   峰值 RSS: {summary['peak_rss_mb']:.0f} MB")
+        if summary["device_peak_mb"]:
+            print(f"   峰值裝置記憶體: {summary['device_peak_mb']:.0f} MB")
+        print(f"   明細: {self.jsonl_path} (.csv / .summary.json 同目錄)")
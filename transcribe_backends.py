@@ -0,0 +1,101 @@
+import os
+
+# =================================================================
+# 🎙️ 聽寫後端 (02_harvest_youtube.py / 02_benchmark_transcribe.py)
+# 每個後端都提供 transcribe(audio) -> [{"start", "end", "text"}, ...]，
+# 所以 raw_transcripts/ 的輸出格式跟用哪個後端無關
+#
+# - whisper        : OpenAI 原版，有 CUDA 時用 (沒有 GPU 會退回 CPU fp32，非常慢)
+# - faster-whisper : CTranslate2 int8 量化，CPU 也跑得動；
+#                    先用 VAD (Silero) 切掉靜音與 BGM，再把語音片段分批平行解碼
+# =================================================================
+
+SAMPLE_RATE = 16000
+
+# faster-whisper 設定
+FASTER_WHISPER_COMPUTE_TYPE = "int8"          # CPU 用 int8
+FASTER_WHISPER_GPU_COMPUTE_TYPE = "float16"   # GPU 用；顯示卡記憶體不夠可以改 "int8_float16"
+FASTER_WHISPER_BATCH_SIZE = 8         # 一次平行解碼幾段語音
+FASTER_WHISPER_CPU_THREADS = os.cpu_count() or 4
+VAD_PARAMETERS = {"min_silence_duration_ms": 500}
+
+# 原版 Whisper 收語言全名，faster-whisper 只收代碼
+LANGUAGE_CODES = {"japanese": "ja", "english": "en", "chinese": "zh"}
+
+class WhisperBackend:
+    name = "whisper"
+
+    def __init__(self, model_name, device, options):
+        import whisper
+
+        self.model = whisper.load_model(model_name, device=device)
+        self.options = dict(options)
+
+    def transcribe(self, audio):
+        """audio 可以是檔案路徑，或 16 kHz float32 的 numpy 陣列"""
+        result = self.model.transcribe(audio, **self.options)
+        return [{"start": s["start"], "end": s["end"], "text": s["text"]} for s in result["segments"]]
+
+class FasterWhisperBackend:
+    name = "faster-whisper"
+
+    def __init__(self, model_name, device, options):
+        from faster_whisper import BatchedInferencePipeline, WhisperModel
+
+        compute_type = backend_settings(self.name, device)["compute_type"]
+        model = WhisperModel(model_name, device=device, compute_type=compute_type, cpu_threads=FASTER_WHISPER_CPU_THREADS)
+        self.pipeline = BatchedInferencePipeline(model)
+        self.options = dict(options)
+        language = self.options.get("language")
+        if language:
+            self.options["language"] = LANGUAGE_CODES.get(language.lower(), language)
+
+    def transcribe(self, audio):
+        segments, _ = self.pipeline.transcribe(
+            audio,
+            batch_size=FASTER_WHISPER_BATCH_SIZE,
+            vad_filter=True,
+            vad_parameters=VAD_PARAMETERS,
+            **self.options,
+        )
+        # segments 是 generator，真正的解碼在走訪時才發生
+        return [{"start": s.start, "end": s.end, "text": s.text} for s in segments]
+
+BACKENDS = {b.name: b for b in (WhisperBackend, FasterWhisperBackend)}
+
+def backend_settings(name, device):
+    """會影響聽寫結果的後端設定 (02_harvest_youtube.py 的 manifest 會記下來)"""
+    if name == "faster-whisper":
+        return {
+            "compute_type": FASTER_WHISPER_COMPUTE_TYPE if device == "cpu" else FASTER_WHISPER_GPU_COMPUTE_TYPE,
+            "batch_size": FASTER_WHISPER_BATCH_SIZE,
+            "vad": VAD_PARAMETERS,
+        }
+    return {}
+
+def resolve_backend(name, device):
+    """auto：有 CUDA 用原版 Whisper，沒有就用 faster-whisper (沒裝的話還是退回原版)"""
+    if name != "auto":
+        return name
+    if device == "cuda":
+        return "whisper"
+    try:
+        import faster_whisper  # noqa: F401
+        return "faster-whisper"
+    except ImportError:
+        print("⚠️ 沒有安裝 faster-whisper，CPU 會用原版 Whisper (非常慢)：pip install faster-whisper")
+        return "whisper"
+
+def load_backend(name, model_name, device, options):
+    if name not in BACKENDS:
+        raise ValueError(f"未知的聽寫後端: {name} (可用: {', '.join(BACKENDS)})")
+    return BACKENDS[name](model_name, device, options)
+
+def load_audio(path):
+    """解碼成 16 kHz 單聲道 float32，給 benchmark 算音訊長度用"""
+    try:
+        from faster_whisper import decode_audio
+        return decode_audio(path, sampling_rate=SAMPLE_RATE)
+    except ImportError:
+        from whisper.audio import load_audio as whisper_load_audio
+        return whisper_load_audio(path, sr=SAMPLE_RATE)
@@ -0,0 +1,277 @@
+import os
+import re
+import random
+from html.parser import HTMLParser
+
+# =================================================================
+# 🎞️ 推特爬蟲離線重播 (01_harvest_twitter.py / 01_replay_twitter.py)
+# 錄製：01_harvest_twitter.py 設定 RECORD_DIR 後，每次滾動前把整頁 HTML 存成一張快照
+# 重播：ReplayPage / ReplayTab 模擬 ChromiumPage 用到的那幾個介面
+#       (get / url / eles / ele / parent / attr / set.attr / scroll.to_bottom / html)，
+#       每滾動一次換下一張快照，不用登入、不用網路
+# 另外可以產生大量假時間軸 (make_synthetic_timeline)，拿來測速度與去重是否正確
+# =================================================================
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+def snapshot_dir(record_dir, url):
+    # https://twitter.com/uruhasub/with_replies -> uruhasub_with_replies
+    name = re.sub(r"^https?://[^/]+/", "", url).strip("/")
+    return os.path.join(record_dir, re.sub(r"[^\w.-]+", "_", name) or "_root")
+
+def save_snapshot(record_dir, url, step, html):
+    folder = snapshot_dir(record_dir, url)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, f"{step:04d}.html"), "w", encoding="utf-8") as f:
+        f.write(html)
+
+def list_snapshots(record_dir, url):
+    folder = snapshot_dir(record_dir, url)
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith(".html")]
+
+# ================= 迷你 DOM =================
+
+class _Setter:
+    def __init__(self, node):
+        self._node = node
+
+    def attr(self, name, value):
+        self._node.attrs[name] = value
+        if self._node.on_mark is not None:
+            self._node.on_mark(self._node, name, value)
+
+class Node:
+    def __init__(self, tag, attrs, parent=None):
+        self.tag = tag
+        self.attrs = dict(attrs)
+        self.children = []  # Node 或 str
+        self.parent_node = parent
+        self.on_mark = None
+        self.set = _Setter(self)
+
+    @property
+    def text(self):
+        parts = []
+        for child in self.children:
+            parts.append(child if isinstance(child, str) else child.text)
+        return "".join(parts)
+
+    def attr(self, name):
+        return self.attrs.get(name)
+
+    def iter(self):
+        for child in self.children:
+            if isinstance(child, Node):
+                yield child
+                yield from child.iter()
+
+    def parent(self, loc=1):
+        if isinstance(loc, int):
+            node = self
+            for _ in range(loc):
+                node = node.parent_node if node is not None else None
+            return node
+        match = compile_locator(loc)
+        node = self.parent_node
+        while node is not None and not match(node):
+            node = node.parent_node
+        return node
+
+    def eles(self, loc):
+        match = compile_locator(loc)
+        return [n for n in self.iter() if match(n)]
+
+    def ele(self, loc, timeout=None):
+        found = self.eles(loc)
+        return found[0] if found else None
+
+class _TreeBuilder(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node("#document", {})
+        self.current = self.root
+
+    def handle_starttag(self, tag, attrs):
+        node = Node(tag, [(k, v if v is not None else "") for k, v in attrs], self.current)
+        self.current.children.append(node)
+        if tag not in VOID_TAGS:
+            self.current = node
+
+    def handle_startendtag(self, tag, attrs):
+        node = Node(tag, [(k, v if v is not None else "") for k, v in attrs], self.current)
+        self.current.children.append(node)
+
+    def handle_endtag(self, tag):
+        node = self.current
+        while node is not self.root and node.tag != tag:
+            node = node.parent_node
+        if node is not self.root:
+            self.current = node.parent_node
+
+    def handle_data(self, data):
+        self.current.children.append(data)
+
+def parse_html(html):
+    builder = _TreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+# 只支援爬蟲實際用到的語法：tag:xxx、css:tag[attr="v"][attr]:not([attr])
+_ATTR_RE = re.compile(r'(:not\()?\[([\w-]+)(?:="([^"]*)")?\]\)?')
+
+def compile_locator(loc):
+    if loc.startswith("tag:"):
+        tag = loc[4:]
+        return lambda n: n.tag == tag
+    if not loc.startswith("css:"):
+        raise ValueError(f"不支援的定位語法: {loc}")
+    selector = loc[4:]
+    tag = re.match(r"[\w-]*", selector).group(0)
+    conditions = [(bool(neg), name, value) for neg, name, value in _ATTR_RE.findall(selector[len(tag):])]
+
+    def match(node):
+        if tag and node.tag != tag:
+            return False
+        for negated, name, value in conditions:
+            if value:
+                hit = node.attrs.get(name) == value
+            else:
+                hit = name in node.attrs
+            if hit == negated:
+                return False
+        return True
+    return match
+
+# ================= 重播後端 =================
+
+class _Scroller:
+    def __init__(self, tab):
+        self._tab = tab
+
+    def to_bottom(self):
+        self._tab.advance()
+
+class ReplayTab:
+    """一個分頁：get() 載入某個目標的快照序列，每次 scroll.to_bottom() 換下一張"""
+
+    def __init__(self, record_dir):
+        self.record_dir = record_dir
+        self.url = ""
+        self.snapshots = []
+        self.step = 0
+        self.document = None
+        # 真的瀏覽器滾動時，還留在畫面上的推文節點是同一個 DOM 節點，set.attr 打的標記會留著；
+        # 重播時每張快照都重新解析，所以用推文連結當 key 把標記搬到下一張
+        self.marks = {}
+        self.scroll = _Scroller(self)
+
+    def get(self, url):
+        self.url = url
+        self.snapshots = list_snapshots(self.record_dir, url)
+        self.step = 0
+        self._load()
+
+    def advance(self):
+        if self.step < len(self.snapshots) - 1:
+            self.step += 1
+            self._load()
+
+    @property
+    def html(self):
+        if not self.snapshots:
+            return ""
+        with open(self.snapshots[self.step], "r", encoding="utf-8") as f:
+            return f.read()
+
+    def _node_key(self, node):
+        article = node.parent("tag:article")
+        link = None
+        if article is not None:
+            for a in article.eles("tag:a"):
+                if "/status/" in (a.attr("href") or ""):
+                    link = a.attr("href")
+                    break
+        return (link, node.text)
+
+    def _remember(self, node, name, value):
+        self.marks.setdefault(self._node_key(node), {})[name] = value
+
+    def _load(self):
+        self.document = parse_html(self.html)
+        for node in self.document.iter():
+            node.on_mark = self._remember
+            if "data-testid" in node.attrs:
+                node.attrs.update(self.marks.get(self._node_key(node), {}))
+
+    def eles(self, loc):
+        return self.document.eles(loc) if self.document is not None else []
+
+    def ele(self, loc, timeout=None):
+        return self.document.ele(loc) if self.document is not None else None
+
+    def close(self):
+        pass
+
+class ReplayPage(ReplayTab):
+    """對應 ChromiumPage：本身也是一個分頁，new_tab() 再開新的"""
+
+    def new_tab(self, url=None):
+        tab = ReplayTab(self.record_dir)
+        if url:
+            tab.get(url)
+        return tab
+
+# ================= 假時間軸 =================
+
+TWEET_HTML = (
+    '<article data-testid="tweet"><div class="user"><a href="/uruha">@uruha</a>'
+    '<a href="/uruha/status/{tweet_id}"><time datetime="{time}">{time}</time></a></div>'
+    '<div data-testid="tweetText" lang="ja"><span>{text}</span></div></article>'
+)
+PAGE_HTML = '<html><body><main><section aria-label="Timeline">{tweets}</section></main></body></html>'
+
+def _variant(text, rng, fuzzy=True):
+    """同一句話的「看起來不一樣」版本，去重應該要認得出來
+    前兩種 (空白、全形數字) 一律會被正規化；後兩種 (標點、大小寫) 只有 FUZZY_DEDUP 才認得"""
+    choice = rng.randrange(4 if fuzzy else 2)
+    if choice == 0:
+        return text.replace(" ", "  ")
+    if choice == 1:
+        return text.translate({ord(c): ord(c) + 0xFEE0 for c in "0123456789"})  # 全形數字
+    if choice == 2:
+        return text + "！"
+    return text.upper()
+
+def make_synthetic_timeline(record_dir, url, num_tweets, per_screen=20, overlap=8,
+                            dup_rate=0.2, junk_rate=0.1, seed=3407, fuzzy=True):
+    """產生一條假時間軸的快照序列。
+    回傳 {應該收錄的推文文字: 原始貼文編號}，同一則貼文的各種變體對到同一個編號，
+    爬完後檢查「每個編號剛好收一次」就知道去重有沒有漏或多"""
+    rng = random.Random(seed)
+    base_id = 1_800_000_000_000_000_000 + rng.randrange(10 ** 9)
+    tweets = []
+    answers = {}
+    originals = []
+    for i in range(num_tweets):
+        tweet_id = base_id - i * 1000
+        roll = rng.random()
+        if originals and roll < dup_rate:
+            serial, text = rng.choice(originals)
+            text = _variant(text, rng, fuzzy)
+            answers[text] = serial
+        elif roll < dup_rate + junk_rate:
+            text = rng.choice([f"@friend 返信 {i}", f"見て https://t.co/{i:x}"])
+        else:
+            serial = (seed, i)
+            text = f"配信メモ {seed} {i} ほんとに眠い"
+            originals.append((serial, text))
+            answers[text] = serial
+        tweets.append(TWEET_HTML.format(tweet_id=tweet_id, time=f"2025-01-01T00:00:{i % 60:02d}.000Z", text=text))
+
+    stride = max(1, per_screen - overlap)
+    for step, start in enumerate(range(0, max(1, num_tweets - overlap), stride)):
+        save_snapshot(record_dir, url, step, PAGE_HTML.format(tweets="".join(tweets[start:start + per_screen])))
+    return answers
@@ -0,0 +1,93 @@
+import json
+
+# =================================================================
+# 📦 訓練資料共用讀寫 (03_process_data / 00_clean_dataset / 04_train)
+# 依副檔名決定格式：.json (陣列) / .jsonl (一行一筆) / .arrow (欄式)
+#
+# .arrow 是 Arrow IPC stream 檔 (datasets 快取用的同一種格式)，可以直接 memory-map。
+# instruction 欄位做字典編碼：每筆只存 instruction_id (int32)，
+# 不重複的 instruction 字串只在 schema metadata 裡存一次。
+# 經過 03_dedup_dataset.py 的資料會多一個 weight 欄位 (int32，取代重複複製)。
+# 多輪對話 (03_process_data.py 的 MULTI_TURN) 會多一個 history 欄位：[[user, assistant], ...]，
+# 單輪的資料沒有這個欄位 (Arrow 裡存成空 list，讀回來時拿掉)。
+# =================================================================
+
+INSTRUCTIONS_METADATA_KEY = b"uruha.instructions"
+ARROW_BATCH_SIZE = 1000
+
+def load_rows(path):
+    """讀回 [{"instruction", "input", "output"(, "history")(, "weight")}, ...]"""
+    if path.endswith(".arrow"):
+        return read_arrow_rows(path)
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+def write_rows(rows, path):
+    if path.endswith(".arrow"):
+        write_arrow(rows, path)
+    elif path.endswith(".jsonl"):
+        with open(path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(list(rows), f, ensure_ascii=False, indent=2)
+
+def write_arrow(rows, path):
+    import pyarrow as pa
+
+    rows = list(rows)
+    instructions = []
+    instruction_ids = {}
+    for row in rows:
+        if row["instruction"] not in instruction_ids:
+            instruction_ids[row["instruction"]] = len(instructions)
+            instructions.append(row["instruction"])
+
+    fields = [("instruction_id", pa.int32()), ("input", pa.string()), ("output", pa.string())]
+    weighted = any("weight" in row for row in rows)
+    if weighted:
+        fields.append(("weight", pa.int32()))
+    multi_turn = any(row.get("history") for row in rows)
+    if multi_turn:
+        fields.append(("history", pa.list_(pa.list_(pa.string()))))
+    schema = pa.schema(
+        fields,
+        metadata={INSTRUCTIONS_METADATA_KEY: json.dumps(instructions, ensure_ascii=False).encode("utf-8")},
+    )
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_stream(sink, schema) as writer:
+        for start in range(0, len(rows), ARROW_BATCH_SIZE):
+            batch = rows[start:start + ARROW_BATCH_SIZE]
+            columns = [
+                pa.array([instruction_ids[r["instruction"]] for r in batch], pa.int32()),
+                pa.array([r["input"] for r in batch], pa.string()),
+                pa.array([r["output"] for r in batch], pa.string()),
+            ]
+            if weighted:
+                columns.append(pa.array([r.get("weight", 1) for r in batch], pa.int32()))
+            if multi_turn:
+                columns.append(pa.array([r.get("history") or [] for r in batch], pa.list_(pa.list_(pa.string()))))
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+
+def read_arrow_instructions(path):
+    """只讀 schema，拿回字典編碼的 instruction 清單 (index = instruction_id)"""
+    import pyarrow as pa
+
+    with pa.memory_map(path, "r") as source:
+        metadata = pa.ipc.open_stream(source).schema.metadata or {}
+    return json.loads(metadata.get(INSTRUCTIONS_METADATA_KEY, b"[]").decode("utf-8"))
+
+def read_arrow_rows(path):
+    import pyarrow as pa
+
+    instructions = read_arrow_instructions(path)
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_stream(source).read_all()
+    rows = table.to_pylist()
+    for row in rows:
+        row["instruction"] = instructions[row.pop("instruction_id")]
+        if "history" in row and not row["history"]:
+            del row["history"]
+    return rows